@@ -0,0 +1,188 @@
+import numpy as np
+import scipy
+import grn, simulator
+import msdflipflop, counter2m
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+
+# ------------------------
+# SETTINGS
+# ------------------------
+
+# Size ladder, 0 is a single self-latched flip-flop, d > 0 a counter with d cells
+SIZES = [0, 1, 2, 4, 8, 16, 32]
+
+# Every measurement is repeated and the fastest run is kept
+REPEATS = 3
+
+# Number of right-hand side evaluations per measurement
+RHS_CALLS = 1000
+
+# Simulation time of a single step and the clock sequence of the simulations
+T_SINGLE = 100
+clks = np.concatenate([np.repeat(0, 2), [100 if i%2==0 else 0 for i in range(4)]])
+
+# Relative slowdown against the baseline that counts as a regression
+TOLERANCE = 0.25
+
+# ------------------------
+# WORKLOADS
+# ------------------------
+
+# Builds the network of a given size, the builders' warnings are not part of the benchmark
+def build_network(size):
+    network = grn.grn()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        if size == 0:
+            msdflipflop.registercell("cell", network, inputname="cell_QBAR")
+        else:
+            counter2m.counterregister(network, size)
+
+    return network
+
+# Wall time of the fastest of repeats runs of func, setup is called (untimed) before every run
+def timed(func, repeats=REPEATS, setup=None):
+    best = np.inf
+
+    for _ in range(repeats):
+        if setup:
+            setup()
+        np.random.seed(0)
+
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+def bench_network(size, repeats=REPEATS):
+    network = build_network(size)
+    n_inputs = len(network.input_species_names)
+    state = np.random.default_rng(0).random(len(network.species_names))
+
+    results = {'species': len(network.species_names), 'genes': len(network.genes)}
+
+    results['build'] = timed(lambda: build_network(size), repeats)
+    results['generate_source'] = timed(network.generate_model_source, repeats)
+    # compiled models are cached, the cache is emptied before every run
+    results['compile'] = timed(network.compile_model, repeats, grn._model_cache.clear)
+
+    model = network.compile_model()
+    results['rhs_call'] = timed(lambda: [model.solve_model(0, state) for _ in range(RHS_CALLS)], repeats)/RHS_CALLS
+
+    results['simulate_single'] = timed(lambda: simulator.simulate_single(network, [100]*n_inputs, t_end=T_SINGLE, plot_on=False), repeats)
+    results['simulate_sequence'] = timed(lambda: simulator.simulate_sequence(network, clks, t_single=T_SINGLE, plot_on=False), repeats)
+    results['get_steady'] = timed(lambda: simulator.get_steady(network), repeats)
+
+    return results
+
+# One evaluation of the fitness function of each GA driver, on a fixed solution
+def bench_fitness(repeats=REPEATS):
+    import optialgo_cell, optialgo_reg
+
+    rng = np.random.default_rng(0)
+    results = {}
+
+    cell_values = [(optialgo_cell.DECAY_VALUES, optialgo_cell.DECAY_GENES),
+                   (optialgo_cell.KD_VALUES, optialgo_cell.KD_GENES),
+                   (optialgo_cell.N_VALUES, optialgo_cell.N_GENES)]
+    solution = np.concatenate([rng.integers(0, len(values), genes) for values, genes in cell_values])
+    results['optialgo_cell'] = timed(lambda: optialgo_cell.fitness_func(None, solution, 0), repeats)
+
+    reg_values = [(optialgo_reg.CELL_DECAY_VALUES, optialgo_reg.CELL_DECAY_GENES),
+                  (optialgo_reg.CELL_KD_VALUES, optialgo_reg.CELL_KD_GENES),
+                  (optialgo_reg.CELL_N_VALUES, optialgo_reg.CELL_N_GENES),
+                  (optialgo_reg.INSTR_DECAY_VALUES, optialgo_reg.INSTR_DECAY_GENES),
+                  (optialgo_reg.CONN_KD_VALUES, optialgo_reg.CONN_KD_GENES),
+                  (optialgo_reg.CONN_N_VALUES, optialgo_reg.CONN_N_GENES)]
+    solution = np.concatenate([rng.integers(0, len(values), genes) for values, genes in reg_values])
+    with contextlib.redirect_stdout(io.StringIO()):
+        results['optialgo_reg'] = timed(lambda: optialgo_reg.fitness_func(None, solution, 0), repeats)
+
+    return results
+
+# ------------------------
+# RUNNING AND COMPARING
+# ------------------------
+
+def run(sizes=SIZES, repeats=REPEATS, fitness=True):
+    report = {'meta': {'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'python': platform.python_version(),
+                       'numpy': np.__version__,
+                       'scipy': scipy.__version__,
+                       'machine': platform.platform(),
+                       'repeats': repeats,
+                       't_single': T_SINGLE},
+              'results': {}}
+
+    for size in sizes:
+        name = 'flipflop' if size == 0 else f'counter_{size}'
+        report['results'][name] = bench_network(size, repeats)
+        print(name, ' '.join(f'{key}={value:.4g}' for key, value in report['results'][name].items()), file=sys.stderr)
+
+    if fitness:
+        report['results']['fitness'] = bench_fitness(repeats)
+        print('fitness', ' '.join(f'{key}={value:.4g}' for key, value in report['results']['fitness'].items()), file=sys.stderr)
+
+    return report
+
+# Ratios of the times against a baseline report, all measurements are wall times (lower is better)
+def compare(report, baseline, tolerance=TOLERANCE):
+    rows = []
+
+    for case, results in report['results'].items():
+        for key, value in results.items():
+            if key in ('species', 'genes'):
+                continue
+
+            old = baseline['results'].get(case, {}).get(key)
+            if old is None:
+                continue
+
+            ratio = value/old if old > 0 else np.inf
+            rows.append({'case': case, 'metric': key, 'baseline': old, 'current': value,
+                         'ratio': ratio, 'regression': bool(ratio > 1 + tolerance)})
+
+    return rows
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Headless benchmarks of model generation, simulation and GA fitness evaluation.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='0 for a single flip-flop, d for a counter with d cells')
+    parser.add_argument('--repeats', type=int, default=REPEATS)
+    parser.add_argument('--no-fitness', action='store_true', help='skip the GA fitness functions')
+    parser.add_argument('--out', help='JSON file for the results (stdout if not given)')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    report = run(args.sizes, args.repeats, not args.no_fitness)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        report['comparison'] = compare(report, baseline, args.tolerance)
+        regressions = [row for row in report['comparison'] if row['regression']]
+
+        for row in report['comparison']:
+            print(f"{row['case']:>12} {row['metric']:>18} {row['baseline']:10.4g} {row['current']:10.4g} {row['ratio']:6.2f}"
+                  + ("  REGRESSION" if row['regression'] else ""), file=sys.stderr)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    # a nonzero exit status lets scripts catch regressions
+    sys.exit(1 if regressions else 0)
@@ -3,9 +3,9 @@ import matplotlib.pyplot as plt
 import grn, simulator
 import networkx as nx
 import faulthandler
-from msdflipflop import registercell
+from msdflipflop import registercell, celltemplate
 
-def counterregister(network, d, clkname=None, cell_decays=None, cell_Kds=None, cell_ns=None, instr_decays=None, conn_Kds=None, conn_ns=None):
+def counterregister(network, d, clkname=None, cell_decays=None, cell_Kds=None, cell_ns=None, instr_decays=None, conn_Kds=None, conn_ns=None, template=False):
 
     # ------------------------
     # PARAMETERS
@@ -53,12 +53,21 @@ def counterregister(network, d, clkname=None, cell_decays=None, cell_Kds=None, c
         clkname="CLK"
         network.add_input_species(clkname)
 
-    # Initialize the first cell with clk the negated output of the last 
-    registercell("CELL_1", network, clkname, f"CELL_{d}_QBAR", cell_decays, cell_Kds, cell_ns)
+    # All cells as instances of one flip-flop template, simulated together as a batch of cells
+    if template:
+        cell = celltemplate(cell_decays, cell_Kds, cell_ns)
 
-    # Initialize the rest of the cells with clk and output of the previous cell
-    for c in range(2, d+1):
-        registercell(f"CELL_{c}", network, clkname, f"CELL_{c-1}_Q", cell_decays, cell_Kds, cell_ns)
+        network.add_instance(cell, "CELL_1", {"CLK": clkname, "D": f"CELL_{d}_QBAR"})
+        for c in range(2, d+1):
+            network.add_instance(cell, f"CELL_{c}", {"CLK": clkname, "D": f"CELL_{c-1}_Q"})
+
+    else:
+        # Initialize the first cell with clk the negated output of the last 
+        registercell("CELL_1", network, clkname, f"CELL_{d}_QBAR", cell_decays, cell_Kds, cell_ns)
+
+        # Initialize the rest of the cells with clk and output of the previous cell
+        for c in range(2, d+1):
+            registercell(f"CELL_{c}", network, clkname, f"CELL_{c-1}_Q", cell_decays, cell_Kds, cell_ns)
 
     # ------------------------
     # BUILDING THE DECODER
@@ -95,37 +104,28 @@ def counterregister(network, d, clkname=None, cell_decays=None, cell_Kds=None, c
 
 def truthgenerator(clks, d):
 
-    # Extract every rising edge
-    rising = [i for i in range(len(clks)-1) if clks[i+1]-clks[i]==100]
-
-    # Initialize the array for ground truths
-    truth = np.array([])
+    clks = np.asarray(clks)
 
-    for i in range(2*d):
-
-        # Keeping only the rising edges that would activate or deactivate an instruction
-        cntr = [rising[pt] for pt in range(len(rising)) if (pt%(2*d)==i or pt%(2*d)==((i+1)%(2*d)))]
-
-        # Removing the first rising edge from last instruction as it's unnecessary
-        if i == (2*d)-1:
-            cntr = cntr[1:]
-
-        cntr = [0] + cntr + [len(clks)-1]
+    # Extract every rising edge
+    rising = np.flatnonzero(np.diff(clks) == 100)
 
-        inst = np.array([])
+    # Instruction i toggles at the rising edges with ordinal i or i+1 (mod 2*D)
+    ordinal = np.arange(len(rising)) % (2*d)
+    inst = np.arange(2*d)[:, None]
+    toggles_at = (ordinal == inst) | (ordinal == (inst+1) % (2*d))
 
-        # Construct ground truth based on clock inputs
-        for p in range(len(cntr)-1):
-            inst = np.concatenate([inst, np.repeat(100-(100 if len(inst)==0 else inst[-1]), cntr[p+1]-cntr[p])])
+    # Removing the first rising edge from last instruction as it's unnecessary
+    toggles_at[2*d-1, :1] = False
 
-        inst = np.concatenate([[clks[0]], inst])
+    # An edge at the very start does not change the output
+    toggles_at[:, rising == 0] = False
 
-        if len(truth) == 0:
-            truth = np.array([inst])
-        else:
-            truth = np.append(truth, [inst], axis=0)
-    return truth
+    # Construct ground truth based on clock inputs, the parity of the toggles so far
+    toggles = np.zeros((2*d, max(len(clks)-1, 0)), dtype=np.int64)
+    toggles[:, rising] = toggles_at
+    truth = 100.0*(np.cumsum(toggles, axis=1) % 2)
 
+    return np.concatenate([np.repeat(clks[:1][None, :], 2*d, axis=0), truth], axis=1)
 
 
 if __name__ == "__main__":
@@ -1,27 +1,109 @@
 
 import numpy as np
 import simulator
+import kernels
 from helpers import powerset
 
+import hashlib
+import types
+import marshal
+import sys
+from collections import OrderedDict
+
+from scipy import sparse
+
 import networkx as nx
 import matplotlib.pyplot as plt
 
 
+# compiled models, keyed by the structural hash of the network
+MODEL_CACHE_SIZE = 256
+_model_cache = OrderedDict()
+
+
+def _cache_model(h, model_module):
+    _model_cache[h] = model_module
+    if len(_model_cache) > MODEL_CACHE_SIZE:
+        _model_cache.popitem(last=False)
+
+    return model_module
+
+
+def _factor_key(name, Kd, n=None):
+    # Hill factors (and ratios, without n) are shared between regulators with the same values,
+    # or with the same parameter names in parametric models
+    if type(Kd) == str:
+        return (name, Kd) if n is None else (name, Kd, n)
+    return (name, float(Kd)) if n is None else (name, float(Kd), float(n))
+
+
+def _exec_model(h, code):
+    # module of a compiled model source
+    model_module = types.ModuleType(f'grn_model_{h[:12]}')
+    exec(code, model_module.__dict__)
+    return model_module
+
 
 class grn:
     def __init__(self):
-        self.species = []        
         self.species_names = []
+        self.species_index = {}      # name -> index in species_names
         self.input_species_names = []
-        self.genes = []
+        self.instances = []
+
+        # species and genes are stored as columns, regulators and products of gene g
+        # are the entries reg_ptr[g]:reg_ptr[g+1] and prod_ptr[g]:prod_ptr[g+1] of their columns
+        self._delta = []
+        self._alpha = []
+        self._logic = []
+        self._reg_ptr = [0]
+        self._reg_name = []
+        self._reg_type = []
+        self._reg_Kd = []
+        self._reg_n = []
+        self._prod_ptr = [0]
+        self._prod_name = []
+
+        self._changed()
+
+    def _changed(self):
+        # drops the cached views of the network
+        self._species_view = None
+        self._genes_view = None
+        self._arrays = None
 
     def add_input_species(self, name):        
         self.add_species(name, 0) # input species are species that do not degrade
         self.input_species_names.append(name)
 
     def add_species(self, name, delta):
-        self.species.append({'name': name, 'delta': delta})
+        self.species_index[name] = len(self.species_names)
         self.species_names.append(name)
+        self._delta.append(delta)
+        self._changed()
+
+    @property
+    def species(self):
+        # list of {'name', 'delta'} dicts, a read-only view of the species columns
+        if self._species_view is None:
+            self._species_view = [{'name': name, 'delta': delta} for name, delta in zip(self.species_names, self._delta)]
+        return self._species_view
+
+    @property
+    def genes(self):
+        # list of gene dicts as passed to add_gene, a read-only view of the gene columns
+        if self._genes_view is None:
+            genes = []
+            for g in range(len(self._alpha)):
+                regs = range(self._reg_ptr[g], self._reg_ptr[g+1])
+                prods = range(self._prod_ptr[g], self._prod_ptr[g+1])
+                genes.append({'alpha': self._alpha[g],
+                              'regulators': [{'name': self._reg_name[r], 'type': self._reg_type[r],
+                                              'Kd': self._reg_Kd[r], 'n': self._reg_n[r]} for r in regs],
+                              'products': [{'name': self._prod_name[p]} for p in prods],
+                              'logic_type': self._logic[g]})
+            self._genes_view = genes
+        return self._genes_view
 
     """
         regulator = {'name': str - name,
@@ -36,64 +118,218 @@ class grn:
         if logic_type == 'mixed':
             logic_type = np.random.choice(['and', 'or'])
 
-        gene = {'alpha': alpha,
-                'regulators': regulators,
-                'products': products,
-                'logic_type': logic_type}
-        
         for regulator in regulators:
-            if regulator['name'] not in self.species_names:
+            if regulator['name'] not in self.species_index:
                 print(f'{regulator["name"]} not in species!')
 
+            self._reg_name.append(regulator['name'])
+            self._reg_type.append(regulator['type'])
+            self._reg_Kd.append(regulator['Kd'])
+            self._reg_n.append(regulator['n'])
+
         for product in products:
-            if product['name'] not in self.species_names:
+            if product['name'] not in self.species_index:
                 print(f'{product["name"]} not in species!')
 
+            self._prod_name.append(product['name'])
+
+        self._alpha.append(alpha)
+        self._logic.append(logic_type)
+        self._reg_ptr.append(len(self._reg_name))
+        self._prod_ptr.append(len(self._prod_name))
+        self._changed()
+
+    def add_genes(self, alpha, regulators, types, Kds, ns, products, logic_type='and'):
+        # adds many genes at once from arrays
+        # regulators - (genes, slots) species names or indices, slots with type 0 are unused
+        # types, Kds, ns - broadcast to the shape of regulators
+        # products - (genes,) or (genes, slots) species names or indices, -1 or None marks unused slots
+        # alpha, logic_type - one value or one per gene
+        names = np.array(self.species_names + [None], dtype=object)
+
+        regulators = np.asarray(regulators)
+        if regulators.ndim == 1:
+            regulators = regulators[:, None]
+        n_genes = len(regulators)
+
+        types = np.broadcast_to(types, regulators.shape)
+        Kds = np.broadcast_to(Kds, regulators.shape)
+        ns = np.broadcast_to(ns, regulators.shape)
+        alpha = np.broadcast_to(alpha, (n_genes,))
+
+        products = np.asarray(products)
+        if products.ndim == 1:
+            products = products[:, None]
+
+        if regulators.dtype.kind in 'iu':
+            regulators = names[regulators]
+        if products.dtype.kind in 'iu':
+            products = names[products]
+
+        used = types != 0
+        self._reg_name.extend(regulators[used].tolist())
+        self._reg_type.extend(types[used].tolist())
+        self._reg_Kd.extend(Kds[used].tolist())
+        self._reg_n.extend(ns[used].tolist())
+
+        used_products = (products != None) & (products != -1)
+        self._prod_name.extend(products[used_products].tolist())
+
+        unknown = set(self._reg_name[self._reg_ptr[-1]:]) | set(self._prod_name[self._prod_ptr[-1]:])
+        for name in unknown - self.species_index.keys():
+            print(f'{name} not in species!')
+
+        if type(logic_type) == str:
+            logic_type = [logic_type]*n_genes
+        logic_type = [str(np.random.choice(['and', 'or'])) if logic == 'mixed' else str(logic) for logic in logic_type]
+
+        self._reg_ptr.extend((self._reg_ptr[-1] + np.cumsum(used.sum(axis=1))).tolist())
+        self._prod_ptr.extend((self._prod_ptr[-1] + np.cumsum(used_products.sum(axis=1))).tolist())
+        self._alpha.extend(alpha.tolist())
+        self._logic.extend(logic_type)
+        self._changed()
+
+    def gene_arrays(self):
+        # the gene columns as numpy arrays with species indices, cached until the network changes
+        if self._arrays is None:
+            index = self.species_index
+            self._arrays = {'alpha': np.array(self._alpha, dtype=float),
+                            'logic': np.array([kernels.LOGIC_CODES[logic] for logic in self._logic], dtype=np.int64),
+                            'reg_ptr': np.array(self._reg_ptr, dtype=np.int64),
+                            'reg_idx': np.array([index[name] for name in self._reg_name], dtype=np.int64),
+                            'reg_type': np.array(self._reg_type, dtype=np.int64),
+                            'reg_Kd': np.array(self._reg_Kd, dtype=float),
+                            'reg_n': np.array(self._reg_n, dtype=float),
+                            'prod_ptr': np.array(self._prod_ptr, dtype=np.int64),
+                            'prod_idx': np.array([index[name] for name in self._prod_name], dtype=np.int64),
+                            'delta': np.array(self._delta, dtype=float)}
+        return self._arrays
+
+    def regulation_edges(self):
+        # (regulator, product, type) species index arrays of every regulator of every product
+        arrays = self.gene_arrays()
+        reg_ptr = arrays['reg_ptr']
+
+        prod_gene = np.repeat(np.arange(len(reg_ptr) - 1), np.diff(arrays['prod_ptr']))
+        counts = np.diff(reg_ptr)[prod_gene]
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        positions = np.repeat(reg_ptr[prod_gene], counts) + offsets
+
+        return arrays['reg_idx'][positions], np.repeat(arrays['prod_idx'], counts), arrays['reg_type'][positions]
+
+
+    def generate_factors(self, derivatives=False, genes=None):
+        # statements computing every distinct Hill factor (X/Kd)**n once, and optionally its derivative
+        # the ratios X/Kd are shared between factors with different n, negative concentrations (solver overshoots)
+        # count as 0, so that non-integer n stays real
+        # genes - view of the genes to use (parameter_view), the network's by default
+        ratio_names = {}
+        factor_names = {}
+        d_factor_names = {}
+        statements = []
+
+        for gene in self.genes if genes is None else genes:
+            for regulator in gene['regulators']:
+                name = regulator['name']
+                n = regulator['n']
+                Kd = regulator['Kd']
 
-        self.genes.append(gene)
+                key = _factor_key(name, Kd, n)
+                if key in factor_names:
+                    continue
 
+                ratio_key = _factor_key(name, Kd)
+                if ratio_key not in ratio_names:
+                    ratio_names[ratio_key] = f'r{len(ratio_names)}'
+                    statements.append(f'{ratio_names[ratio_key]} = ({name} if {name} > 0 else 0)/{Kd}')
+                r = ratio_names[ratio_key]
 
-    def generate_equations(self):
-        equations = {}
-        
-        for species in self.species:
-            equations[species['name']] = [f'-{species["name"]}*{species["delta"]}']
+                k = len(factor_names)
+                factor_names[key] = f'h{k}'
+                statements.append(f'h{k} = {r}**{n}')
 
-        for gene in self.genes:
-            
-            up = []
-            down = []
-            logic_type = gene['logic_type']
+                if derivatives:
+                    d_factor_names[key] = f'g{k}'
+                    statements.append(f'g{k} = {n}/{Kd}*{r}**({n}-1)')
 
+        return statements, factor_names, d_factor_names
 
-            for regulator in gene['regulators']:
-                name = regulator['name']
-                n = regulator['n']
-                Kd = regulator['Kd']
-                
+    def add_instance(self, template, prefix, bindings):
+        # adds a copy of the template network, its input species (ports) are bound to species of this network
+        # and its other species are renamed to prefix + name
+        names = {port: bindings[port] for port in template.input_species_names}
+
+        for species in template.species:
+            if species['name'] not in names:
+                names[species['name']] = prefix + species['name']
+                self.add_species(names[species['name']], species['delta'])
+
+        first_gene = len(self._alpha)
+
+        for gene in template.genes:
+            regulators = [dict(regulator, name=names[regulator['name']]) for regulator in gene['regulators']]
+            products = [{'name': names[product['name']]} for product in gene['products']]
+            self.add_gene(gene['alpha'], regulators, products, gene['logic_type'])
+
+        self.instances.append({'template': template,
+                               'names': names,
+                               'genes': range(first_gene, len(self._alpha))})
+
+    def generate_gene_terms(self, gene, factor_names=None):
+        # regulator factors and the activation (up) / repression (down) terms of a gene
+        factors = []
+        up = []
+        logic_type = gene['logic_type']
+
+        for regulator in gene['regulators']:
+            name = regulator['name']
+            n = regulator['n']
+            Kd = regulator['Kd']
+
+            if factor_names:
+                regulator_term = factor_names[_factor_key(name, Kd, n)]
+            else:
+                regulator_term = f'((({name} if {name} > 0 else 0)/{Kd})**{n})'
+
+            if regulator['type'] == 1:
+                up.append(regulator_term)
+
+            factors.append(regulator_term)
+
+        if not up:
+            up = ['1']
+
+        if logic_type == 'or':
+            up = "+".join(powerset(up, op="*"))
+        elif logic_type == 'and':
+            up = '*'.join(up)
+        elif logic_type == '':
+            up = up[0]
+        else:
+            print("Invalid logic type!")
+            return
+
+        down = "+".join(['1'] + powerset(factors, op="*"))
+
+        return factors, up, down
+
+    def generate_equations(self, factor_names=None, species_list=None, genes=None):
+        # species_list, genes - views of the species and genes to use (parameter_view), the network's by default
+        equations = {}
         
-                regulator_term = f'(({name}/{Kd})**{n})'
-                
-                if regulator['type'] == 1:
-                    up.append(regulator_term)
-                
-                down.append(regulator_term)
-
-            if not up:
-                up = ['1']
-
-            if logic_type == 'or':
-                up = "+".join(powerset(up, op="*"))
-            elif logic_type == 'and':
-                up = '*'.join(up)
-            elif logic_type == '':
-                up = up[0]
+        for species in self.species if species_list is None else species_list:
+            # species that do not degrade get no decay term
+            if species['delta'] == 0:
+                equations[species['name']] = []
             else:
-                print("Invalid logic type!")
-                return
+                equations[species['name']] = [f'-{species["name"]}*{species["delta"]}']
 
-            down = "+".join(['1'] + powerset(down, op="*"))
+        for gene in self.genes if genes is None else genes:
+            terms = self.generate_gene_terms(gene, factor_names)
+            if terms is None:
+                return
 
+            _, up, down = terms
             terms = f'{gene["alpha"]}*({up})/({down})'
 
             for product in gene['products']:
@@ -101,49 +337,303 @@ class grn:
 
         return equations
 
-    def generate_model(self, fname='model.py'):
-        equations = self.generate_equations()
-
-        with open(fname, 'w') as f: 
-            print(f'import numpy as np \n', file = f)
-            print(f'def solve_model(T,state):', file = f)
-            
-            all_keys = ', '.join([f'{key}' for key in equations.keys()])
-            all_dkeys = ', '.join([f'd{key}' for key in equations.keys()])
-            
-            print(f'    {all_keys} = state', file=f)
-
-            for key in equations.keys():
-                print(f'    d{key} = {"+".join(equations[key])}', file=f)
-                
-            print(f'    return np.array([{all_dkeys}])', file=f)
-            
-            #print('',file=f)
-            print('',file=f)
-            print(f'def solve_model_steady(state):', file = f)
-            print(f'    return solve_model(0, state)', file = f)
+    def jacobian_sparsity(self):
+        # structure of the Jacobian from the gene graph: every product depends on the regulators of its gene,
+        # and every species on itself
+        regs, prods, _ = self.regulation_edges()
+        n_species = len(self.species_names)
+        rows = np.concatenate([np.arange(n_species), prods])
+        cols = np.concatenate([np.arange(n_species), regs])
 
+        pattern = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n_species, n_species))
+        pattern.sum_duplicates()
+        pattern.data[:] = 1
 
-    def plot_network(self):
-        activators = {s:[] for s in self.species_names}
-        inhibitors = {s:[] for s in self.species_names}
+        return pattern
 
+    def generate_jacobian(self, factor_names=None, d_factor_names=None, entry=None, species_list=None, genes=None):
+        # statements filling J[i, j] = d(dstate_i)/d(state_j) of the model from generate_equations
+        # entry(i, j) gives the target of an element, J[i, j] by default
+        if entry is None:
+            entry = lambda i, j: f'J[{i}, {j}]'
 
-        for gene in self.genes:
-            for product in gene['products']:
-                activators[product['name']].extend([x['name'] for x in gene['regulators'] if x['type'] == 1])
-                inhibitors[product['name']].extend([x['name'] for x in gene['regulators'] if x['type'] == -1])
+        index = self.species_index
+        statements = []
+
+        for i, species in enumerate(self.species if species_list is None else species_list):
+            if species['delta'] != 0:
+                statements.append(f'{entry(i, i)} = -{species["delta"]}')
+
+        for g, gene in enumerate(self.genes if genes is None else genes):
+            terms = self.generate_gene_terms(gene, factor_names)
+            if terms is None:
+                return
+
+            factors, up, down = terms
+            logic_type = gene['logic_type']
+            activators = [k for k, r in enumerate(gene['regulators']) if r['type'] == 1]
 
-        edges_act = set()
-        edges_inh = set()
+            statements.append(f'u{g} = {up}')
+            statements.append(f'd{g} = {down}')
 
-        for prod in activators:
-            for reg in activators[prod]:
-                edges_act.add((reg, prod))        
+            for k, regulator in enumerate(gene['regulators']):
+                name = regulator['name']
+                n = regulator['n']
+                Kd = regulator['Kd']
+
+                # derivative of the activation (up) term with respect to this factor
+                others = [factors[j] for j in activators if j != k]
+                if k not in activators:
+                    d_up = '0'
+                elif logic_type == 'and':
+                    d_up = '*'.join(others) if others else '1'
+                elif logic_type == 'or':
+                    d_up = '*'.join([f'(1+{o})' for o in others]) if others else '1'
+                else:
+                    d_up = '1' if k == activators[0] else '0'
+
+                # derivative of the repression (down) term, 1 + sum of all products = prod(1 + factor)
+                d_down = '*'.join([f'(1+{factors[j]})' for j in range(len(factors)) if j != k])
+                if not d_down:
+                    d_down = '1'
+
+                if d_factor_names:
+                    d_factor = d_factor_names[_factor_key(name, Kd, n)]
+                else:
+                    d_factor = f'({n}/{Kd}*(({name} if {name} > 0 else 0)/{Kd})**({n}-1))'
+
+                if d_up == '0':
+                    term = f'-{gene["alpha"]}*u{g}*{d_down}/d{g}**2*{d_factor}'
+                else:
+                    term = f'{gene["alpha"]}*({d_up}*d{g}-u{g}*{d_down})/d{g}**2*{d_factor}'
+
+                for product in gene['products']:
+                    statements.append(f'{entry(index[product["name"]], index[name])} += {term}')
+
+        return statements
+
+    def parameter_view(self, ties=None):
+        # species and genes with their numbers replaced by the names p0, p1, ... of the entries of a
+        # parameter vector in the layout of get_params ([alpha, Kd, n, delta])
+        # ties - position whose name is used for every position, parameters that always have the same value
+        # share a name (and so their Hill factors)
+        n_genes = len(self._alpha)
+        n_regs = len(self._reg_name)
+        n_params = n_genes + 2*n_regs + len(self.species_names)
+        p = [f'p{k}' for k in (range(n_params) if ties is None else ties)]
+
+        species = [{'name': name, 'delta': p[2*n_regs + n_genes + k]} for k, name in enumerate(self.species_names)]
+        genes = []
+        for g in range(n_genes):
+            regs = range(self._reg_ptr[g], self._reg_ptr[g+1])
+            genes.append({'alpha': p[g],
+                          'regulators': [{'name': self._reg_name[r], 'type': self._reg_type[r],
+                                          'Kd': p[n_genes + r], 'n': p[n_genes + n_regs + r]} for r in regs],
+                          'products': [{'name': name} for name in self._prod_name[self._prod_ptr[g]:self._prod_ptr[g+1]]],
+                          'logic_type': self._logic[g]})
+
+        return species, genes
+
+    def generate_model_source(self, parametric=False, ties=None):
+        # every Hill factor is computed once per call and shared by all equations
+        # parametric - the numbers are read from a parameter vector (layout of get_params), given to every
+        # function as the last argument, so one source serves every parameter set of the topology
+        # ties - see parameter_view
+        species, genes = self.parameter_view(ties) if parametric else (None, None)
+        params = ',params' if parametric else ''
+        unpack = []
+        if parametric:
+            n_params = len(self._alpha) + 2*len(self._reg_name) + len(self.species_names)
+            unpack = [f'    {", ".join(f"p{k}" for k in range(n_params))}, = params']
+
+        statements, factor_names, _ = self.generate_factors(genes=genes)
+        equations = self.generate_equations(factor_names, species, genes)
+
+        all_keys = ', '.join([f'{key}' for key in equations.keys()])
+        all_dkeys = ', '.join([f'd{key}' for key in equations.keys()])
+
+        # the Jacobian is filled as the data of a CSR matrix with the structure of jacobian_sparsity
+        pattern = self.jacobian_sparsity()
+        rows = np.repeat(np.arange(pattern.shape[0]), np.diff(pattern.indptr))
+        position = {(i, j): k for k, (i, j) in enumerate(zip(rows, pattern.indices))}
+
+        lines = ['import numpy as np ', 'from scipy.sparse import csr_matrix', '']
+        lines.append(f'JAC_SHAPE = {pattern.shape}')
+        lines.append(f'JAC_ROWS = np.array({rows.tolist()}, dtype=np.int64)')
+        lines.append(f'JAC_COLS = np.array({pattern.indices.tolist()}, dtype=np.int64)')
+        lines.append(f'JAC_INDPTR = np.array({pattern.indptr.tolist()}, dtype=np.int64)')
+        lines.append('')
+        lines.append(f'def solve_model(T,state{params}):')
+        lines.append(f'    {all_keys} = state')
+        lines.extend(unpack)
+
+        for statement in statements:
+            lines.append(f'    {statement}')
+
+        for key in equations.keys():
+            lines.append(f'    d{key} = {"+".join(equations[key]) or "0.0"}')
+
+        lines.append(f'    return np.array([{all_dkeys}])')
+
+        lines.append('')
+        lines.append(f'def solve_model_steady(state{params}):')
+        lines.append(f'    return solve_model(0, state{params})')
+
+        statements, factor_names, d_factor_names = self.generate_factors(derivatives=True, genes=genes)
+
+        lines.append('')
+        lines.append(f'def jac_values(T,state{params}):')
+        lines.append(f'    {all_keys} = state')
+        lines.extend(unpack)
+        lines.append(f'    J = np.zeros({pattern.nnz})')
+
+        entry = lambda i, j: f'J[{position[(i, j)]}]'
+        for statement in statements + self.generate_jacobian(factor_names, d_factor_names, entry, species, genes):
+            lines.append(f'    {statement}')
+
+        lines.append(f'    return J')
+
+        lines.append('')
+        lines.append(f'def jac_model(T,state{params}):')
+        lines.append(f'    J = np.zeros(JAC_SHAPE)')
+        lines.append(f'    J[JAC_ROWS, JAC_COLS] = jac_values(T, state{params})')
+        lines.append(f'    return J')
+
+        lines.append('')
+        lines.append(f'def jac_model_sparse(T,state{params}):')
+        lines.append(f'    return csr_matrix((jac_values(T, state{params}), JAC_COLS, JAC_INDPTR), shape=JAC_SHAPE)')
+
+        return '\n'.join(lines) + '\n'
+
+    def generate_model(self, fname='model.py'):
+        with open(fname, 'w') as f:
+            f.write(self.generate_model_source())
+
+    def structural_hash(self):
+        # everything that ends up in the generated model, with numbers normalized to floats
+        species = [(s['name'], float(s['delta'])) for s in self.species]
+        genes = [(float(g['alpha']),
+                  [(r['name'], int(r['type']), float(r['Kd']), float(r['n'])) for r in g['regulators']],
+                  [p['name'] for p in g['products']],
+                  g['logic_type']) for g in self.genes]
+
+        key = repr((species, self.input_species_names, genes))
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def compile_model(self):
+        # compiles the model in memory (no model.py is written) and caches it by structure
+        h = self.structural_hash()
+
+        if h in _model_cache:
+            _model_cache.move_to_end(h)
+            return _model_cache[h]
+
+        code = compile(self.generate_model_source(), f'<grn model {h[:12]}>', 'exec')
+        return _cache_model(h, _exec_model(h, code))
+
+    def topology_hash(self):
+        # the structure without the numbers, networks with the same topology share a parametric model
+        genes = [([(r['name'], int(r['type'])) for r in g['regulators']],
+                  [p['name'] for p in g['products']],
+                  g['logic_type']) for g in self.genes]
+
+        key = repr((self.species_names, self.input_species_names, genes))
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def compile_parametric_model(self, ties=None):
+        # model of the topology taking the parameters as the last argument (solve_model(T, state, params)),
+        # cached by topology, see bind_params
+        # ties - see parameter_view, the model is then only valid for parameters with the tied values equal
+        h = self.topology_hash() + ':parametric'
+        if ties is not None:
+            h += ':' + hashlib.sha1(np.asarray(ties, dtype=np.int64).tobytes()).hexdigest()
+
+        if h in _model_cache:
+            _model_cache.move_to_end(h)
+            return _model_cache[h]
+
+        code = compile(self.generate_model_source(parametric=True, ties=ties), f'<grn parametric model {h[:12]}>', 'exec')
+        return _cache_model(h, _exec_model(h, code))
+
+    def generate_arrays(self, templates=False):
+        return kernels.build_tables(self, templates)
+
+    def get_params(self):
+        # flat parameter vector [alpha, Kd, n, delta] as used by simulator.simulate_ensemble
+        return kernels.get_params(self.generate_arrays())
+
+    def compile_vectorized_model(self):
+        # array-backed alternative to compile_model, evaluates all genes in a few numpy operations
+        h = self.structural_hash() + (':vectorized:templates' if self.instances else ':vectorized')
+
+        if h in _model_cache:
+            _model_cache.move_to_end(h)
+            return _model_cache[h]
+
+        # instances of a template are evaluated together, with the instances as a batch axis
+        return _cache_model(h, kernels.compile_vectorized(self.generate_arrays(templates=True)))
+
+    def columns(self, prefix=''):
+        # the network as plain numpy arrays (no pickling), the templates of instances get prefixes of their own
+        data = {prefix + 'species_names': np.array(self.species_names, dtype=str),
+                prefix + 'input_species_names': np.array(self.input_species_names, dtype=str),
+                prefix + 'delta': np.array(self._delta, dtype=float),
+                prefix + 'alpha': np.array(self._alpha, dtype=float),
+                prefix + 'logic': np.array(self._logic, dtype=str),
+                prefix + 'reg_ptr': np.array(self._reg_ptr, dtype=np.int64),
+                prefix + 'reg_name': np.array(self._reg_name, dtype=str),
+                prefix + 'reg_type': np.array(self._reg_type, dtype=np.int64),
+                prefix + 'reg_Kd': np.array(self._reg_Kd, dtype=float),
+                prefix + 'reg_n': np.array(self._reg_n, dtype=float),
+                prefix + 'prod_ptr': np.array(self._prod_ptr, dtype=np.int64),
+                prefix + 'prod_name': np.array(self._prod_name, dtype=str)}
+
+        templates = []
+        for instance in self.instances:
+            if not any(instance['template'] is template for template in templates):
+                templates.append(instance['template'])
+
+        for t, template in enumerate(templates):
+            data.update(template.columns(f'{prefix}template{t}/'))
+
+        # instance i maps the template species names_key[names_ptr[i]:names_ptr[i+1]] to names_value
+        names = [instance['names'] for instance in self.instances]
+        data[prefix + 'instance_template'] = np.array([[template is instance['template'] for template in templates].index(True)
+                                                       for instance in self.instances], dtype=np.int64)
+        data[prefix + 'instance_genes'] = np.array([[instance['genes'].start, instance['genes'].stop]
+                                                    for instance in self.instances], dtype=np.int64).reshape(-1, 2)
+        data[prefix + 'instance_names_ptr'] = np.cumsum([0] + [len(n) for n in names], dtype=np.int64)
+        data[prefix + 'instance_names_key'] = np.array([key for n in names for key in n], dtype=str)
+        data[prefix + 'instance_names_value'] = np.array([value for n in names for value in n.values()], dtype=str)
+
+        return data
+
+    def save(self, fname, model=True):
+        # compressed .npz of the network columns, its structural hash and (with model=True) the
+        # generated model source and its compiled code, so that loading needs no code generation
+        # networks with template instances are simulated with compile_vectorized_model, which generates no code,
+        # so their model is not saved
+        h = self.structural_hash()
+        data = self.columns()
+        data['hash'] = np.array(h)
+
+        if model and not self.instances:
+            source = self.generate_model_source()
+            code = compile(source, f'<grn model {h[:12]}>', 'exec')
+
+            data['model_source'] = np.array(source)
+            data['model_code'] = np.frombuffer(marshal.dumps(code), dtype=np.uint8)
+            data['model_tag'] = np.array(sys.implementation.cache_tag)
+
+        np.savez_compressed(fname, **data)
+
+
+    def plot_network(self):
+        regs, prods, types = self.regulation_edges()
+        names = np.array(self.species_names, dtype=object)
 
-        for prod in inhibitors:
-            for reg in inhibitors[prod]:
-                edges_inh.add((reg, prod))        
+        edges_act = set(zip(names[regs[types == 1]], names[prods[types == 1]]))
+        edges_inh = set(zip(names[regs[types == -1]], names[prods[types == -1]]))
 
         edges_both = edges_act & edges_inh
         edges_act -= edges_both
@@ -170,6 +660,128 @@ class grn:
 
 
 
+def bind_params(model, params):
+    # model with the interface of compile_model from a parametric model and one parameter vector
+    params = tuple(np.asarray(params, dtype=float).tolist())
+
+    bound = types.ModuleType(model.__name__ + '_bound')
+    bound.params = params
+    bound.JAC_SHAPE = model.JAC_SHAPE
+    bound.solve_model = lambda T, state: model.solve_model(T, state, params)
+    bound.solve_model_steady = lambda state: model.solve_model_steady(state, params)
+    bound.jac_model = lambda T, state: model.jac_model(T, state, params)
+    bound.jac_model_sparse = lambda T, state: model.jac_model_sparse(T, state, params)
+
+    return bound
+
+
+def parameter_map(build, **arguments):
+    # where the entries of the numeric arguments of a builder end up in the parameter vector (get_params)
+    # build(network, **arguments) adds to an empty network, the arguments are lists of numbers
+    # returns the network built with the arguments, its parameters, for every argument the positions
+    # and the entries of the argument that fill them (see fill_params) and the ties of the positions filled
+    # by the same entry (for compile_parametric_model)
+    network = _build_network(build, **arguments)
+
+    # every entry gets a unique marker value, found again in the parameters of a network built with the markers
+    markers = {}
+    start = 1e6 + 0.5
+    for name, values in arguments.items():
+        markers[name] = start + np.arange(len(values))
+        start += len(values)
+
+    marked = _build_network(build, **{name: values.tolist() for name, values in markers.items()})
+    if marked.topology_hash() != network.topology_hash():
+        raise ValueError('The topology of the network depends on the values of the arguments!')
+
+    marked_params = marked.get_params()
+    positions = {}
+    ties = np.arange(len(marked_params))
+    for name, values in markers.items():
+        targets = np.flatnonzero(np.isin(marked_params, values))
+        entries = np.searchsorted(values, marked_params[targets])
+        if len(np.unique(entries)) != len(values):
+            raise ValueError(f'Not every entry of {name} is a parameter of the network!')
+        positions[name] = (targets, entries)
+
+        # every position is tied to the first position of its entry
+        first = np.full(len(values), len(marked_params))
+        np.minimum.at(first, entries, targets)
+        ties[targets] = first[entries]
+
+    return {'network': network, 'params': network.get_params(), 'positions': positions, 'ties': ties}
+
+
+def fill_params(mapping, **arguments):
+    # parameter vector of the network of parameter_map(...) built with other values of its arguments
+    # (arguments that are not given keep their values)
+    params = mapping['params'].copy()
+    for name, values in arguments.items():
+        targets, entries = mapping['positions'][name]
+        params[targets] = np.asarray(values, dtype=float)[entries]
+
+    return params
+
+
+def _build_network(build, **arguments):
+    network = grn()
+    build(network, **arguments)
+    return network
+
+
+def from_columns(data, prefix=''):
+    # grn from the arrays of grn.columns
+    network = grn()
+    network.species_names = data[prefix + 'species_names'].tolist()
+    network.species_index = {name: i for i, name in enumerate(network.species_names)}
+    network.input_species_names = data[prefix + 'input_species_names'].tolist()
+
+    network._delta = data[prefix + 'delta'].tolist()
+    network._alpha = data[prefix + 'alpha'].tolist()
+    network._logic = data[prefix + 'logic'].tolist()
+    network._reg_ptr = data[prefix + 'reg_ptr'].tolist()
+    network._reg_name = data[prefix + 'reg_name'].tolist()
+    network._reg_type = data[prefix + 'reg_type'].tolist()
+    network._reg_Kd = data[prefix + 'reg_Kd'].tolist()
+    network._reg_n = data[prefix + 'reg_n'].tolist()
+    network._prod_ptr = data[prefix + 'prod_ptr'].tolist()
+    network._prod_name = data[prefix + 'prod_name'].tolist()
+
+    instance_template = data[prefix + 'instance_template']
+    templates = [from_columns(data, f'{prefix}template{t}/') for t in range(instance_template.max(initial=-1) + 1)]
+
+    names_ptr = data[prefix + 'instance_names_ptr']
+    keys = data[prefix + 'instance_names_key'].tolist()
+    values = data[prefix + 'instance_names_value'].tolist()
+
+    for i, (t, (start, stop)) in enumerate(zip(instance_template, data[prefix + 'instance_genes'])):
+        names = dict(zip(keys[names_ptr[i]:names_ptr[i+1]], values[names_ptr[i]:names_ptr[i+1]]))
+        network.instances.append({'template': templates[t], 'names': names, 'genes': range(start, stop)})
+
+    return network
+
+
+def load(fname):
+    # network saved with grn.save, a saved model is put in the model cache (no code generation)
+    # the model code is executed, only load files from trusted sources
+    with np.load(fname) as data:
+        network = from_columns(data)
+        h = str(data['hash'])
+
+        if network.structural_hash() != h:
+            print('Structural hash does not match, the saved model is ignored!')
+
+        elif 'model_source' in data and h not in _model_cache:
+            if str(data['model_tag']) == sys.implementation.cache_tag:
+                code = marshal.loads(data['model_code'].tobytes())
+            else:
+                code = compile(str(data['model_source']), f'<grn model {h[:12]}>', 'exec')
+
+            _cache_model(h, _exec_model(h, code))
+
+    return network
+
+
 if __name__ == "__main__":
     my_grn = grn()
     my_grn.add_input_species("X1")
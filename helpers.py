@@ -1,5 +1,9 @@
 import numpy as np
 import itertools
+import hashlib
+import pickle
+import os
+from collections import OrderedDict
 
 # if param is iterable with two elements, a value from a distribution is used
 def get_param_value(param, dist = 'uniform'):
@@ -25,3 +29,138 @@ def powerset(s, op):
     T = itertools.chain.from_iterable(itertools.combinations(s, r) for r in range(len(s)+1))
     return [op.join(t) for t in T if t]
 #    # sestavi vse možne podmnožice seta s, z velikostmi do len(s+1) in jih združi v en sam iterable (from_iterable)
+
+
+def trajectory_mse(Y, truth, columns):
+    # mean squared error of the columns of trajectories Y ((population,) time, species) against truth
+    # ((columns,) time), in one call for a whole population, shape (population, columns) or (population,)
+    # for a single column
+    single = np.ndim(columns) == 0
+    Y = np.asarray(Y)[..., np.atleast_1d(columns)]
+
+    # time is made the last (contiguous) axis, so the means are summed like np.mean of a single trajectory
+    err = np.ascontiguousarray((np.moveaxis(Y, -1, -2) - np.atleast_2d(truth))**2)
+    mse = np.mean(err, axis=-1)
+
+    return mse[..., 0] if single else mse
+
+
+def abort_bound(ga_instance):
+    # score (negated fitness) of the worst parent selected in the last generation, candidates scoring worse
+    # can stop simulating (see simulator.score_sequence), np.inf while there are no parents yet
+    indices = getattr(ga_instance, 'last_generation_parents_indices', None)
+    fitness = getattr(ga_instance, 'last_generation_fitness', None)
+    if indices is None or fitness is None or len(indices) == 0:
+        return np.inf
+
+    return -np.min(np.asarray(fitness)[indices])
+
+
+# fingerprint of the data a fitness function depends on (stimuli, value pools, ...)
+def fingerprint(*data):
+    h = hashlib.sha1()
+    for d in data:
+        if d is None:
+            h.update(b'None')
+        else:
+            d = np.asarray(d)
+            h.update(f'{d.dtype}{d.shape}'.encode())
+            h.update(np.ascontiguousarray(d).tobytes())
+    return h.hexdigest()
+
+
+# LRU cache of fitness values for discrete (integer) gene encodings, optionally kept on disk
+class FitnessCache:
+    def __init__(self, fingerprint='', maxsize=100000, fname=None):
+        self.fingerprint = fingerprint
+        self.maxsize = maxsize
+        self.fname = fname
+        self.hits = 0
+        self.misses = 0
+        self.values = OrderedDict()
+        # keys of solutions whose last evaluation in this process was incomplete, see wrap
+        self.incomplete = set()
+
+        if fname and os.path.exists(fname):
+            self.load(fname)
+
+    def key(self, solution):
+        return (self.fingerprint, tuple(np.asarray(solution).astype(np.int64).tolist()))
+
+    def get(self, solution):
+        key = self.key(solution)
+        if key in self.values:
+            self.values.move_to_end(key)
+            self.hits += 1
+            return self.values[key]
+
+        self.misses += 1
+        return None
+
+    def put(self, solution, fitness):
+        key = self.key(solution)
+        self.values[key] = fitness
+        self.values.move_to_end(key)
+
+        while len(self.values) > self.maxsize:
+            self.values.popitem(last=False)
+
+    def load(self, fname):
+        with open(fname, 'rb') as f:
+            for key, fitness in pickle.load(f).items():
+                self.values[key] = fitness
+
+        while len(self.values) > self.maxsize:
+            self.values.popitem(last=False)
+
+    def save(self, fname=None):
+        fname = fname or self.fname
+        if not fname:
+            return
+
+        # write to a temporary file first so that an interrupted save keeps the old cache
+        with open(fname + '.tmp', 'wb') as f:
+            pickle.dump(dict(self.values), f)
+        os.replace(fname + '.tmp', fname)
+
+    # pygad fitness function wrappers
+    # a fitness function may return (fitness, complete), fitness values that are not complete (e.g. bounds of an
+    # aborted simulation) are passed on to pygad but not cached
+    def wrap(self, fitness_func):
+        def cached_fitness_func(ga_instance, solution, solution_idx):
+            fitness = self.get(solution)
+            if fitness is None:
+                fitness = fitness_func(ga_instance, solution, solution_idx)
+                fitness, complete = fitness if type(fitness) == tuple else (fitness, True)
+
+                if complete:
+                    self.put(solution, fitness)
+                    self.incomplete.discard(self.key(solution))
+                else:
+                    self.incomplete.add(self.key(solution))
+            return fitness
+
+        return cached_fitness_func
+
+    def wrap_batch(self, fitness_func_batch):
+        def cached_fitness_func_batch(ga_instance, solutions, solution_indices):
+            fitness = [self.get(solution) for solution in solutions]
+            missing = [i for i in range(len(solutions)) if fitness[i] is None]
+
+            if missing:
+                indices = None if solution_indices is None else [solution_indices[i] for i in missing]
+                values = fitness_func_batch(ga_instance, solutions[missing], indices)
+                for i, value in zip(missing, values):
+                    fitness[i] = value
+                    self.put(solutions[i], value)
+
+            return fitness
+
+        return cached_fitness_func_batch
+
+    # pygad on_fitness callback, records fitness values computed in worker processes
+    # (incomplete values are only known as such when they were computed in this process)
+    def on_fitness(self, ga_instance, population_fitness):
+        for solution, fitness in zip(ga_instance.population, population_fitness):
+            if self.key(solution) not in self.incomplete:
+                self.put(solution, fitness)
@@ -0,0 +1,361 @@
+import numpy as np
+import types
+from scipy import sparse
+
+
+# logic types of a gene, as used in the gene tables
+LOGIC_CODES = {'and': 0, 'or': 1, '': 2}
+
+
+def build_tables(network, templates=False):
+    # flattens a grn into arrays, genes are padded to the largest number of regulators
+    # with templates=True the genes of template instances are left out of the flat tables and
+    # every template gets its own tables plus a map of its species in each instance
+    species_index = network.species_index
+    arrays = network.gene_arrays()
+
+    n_species = len(network.species_names)
+    keep = np.ones(len(arrays['alpha']), dtype=bool)
+    template_tables = []
+
+    if templates and network.instances:
+        groups = {}
+        for instance in network.instances:
+            groups.setdefault(id(instance['template']), []).append(instance)
+
+        for instances in groups.values():
+            template = instances[0]['template']
+
+            # template species x instances -> species of the network
+            species_map = np.array([[species_index[instance['names'][name]] for instance in instances]
+                                    for name in template.species_names], dtype=np.int64)
+
+            template_tables.append({'tables': build_tables(template), 'map': species_map})
+            for instance in instances:
+                keep[instance['genes'].start:instance['genes'].stop] = False
+
+    # regulators and products of the kept genes, g is the (new) gene of each entry and k its slot
+    n_regs = np.diff(arrays['reg_ptr'])
+    n_prods = np.diff(arrays['prod_ptr'])
+    reg_keep = np.repeat(keep, n_regs)
+    prod_keep = np.repeat(keep, n_prods)
+
+    gene_number = np.cumsum(keep) - 1
+    reg_gene = np.repeat(gene_number, n_regs)[reg_keep]
+    reg_slot = (np.arange(len(reg_keep)) - np.repeat(arrays['reg_ptr'][:-1], n_regs))[reg_keep]
+    prod_gene = np.repeat(gene_number, n_prods)[prod_keep]
+    prod_species = arrays['prod_idx'][prod_keep]
+
+    n_genes = int(keep.sum())
+    n_regs = int(n_regs[keep].max(initial=0))
+
+    reg_idx = np.zeros((n_genes, n_regs), dtype=np.int64)
+    reg_type = np.zeros((n_genes, n_regs), dtype=np.int64)
+    reg_Kd = np.ones((n_genes, n_regs))
+    reg_n = np.ones((n_genes, n_regs))
+
+    reg_idx[reg_gene, reg_slot] = arrays['reg_idx'][reg_keep]
+    reg_type[reg_gene, reg_slot] = arrays['reg_type'][reg_keep]
+    reg_Kd[reg_gene, reg_slot] = arrays['reg_Kd'][reg_keep]
+    reg_n[reg_gene, reg_slot] = arrays['reg_n'][reg_keep]
+
+    alpha = arrays['alpha'][keep]
+    logic = arrays['logic'][keep]
+    delta = arrays['delta'].copy()
+
+    # scatter matrix summing gene expression rates into their products
+    P = sparse.csr_matrix((np.ones(len(prod_gene)), (prod_species, prod_gene)), shape=(n_species, n_genes))
+
+    reg_mask = reg_type != 0
+    act = reg_type == 1
+
+    # first activator of each gene (used by the '' logic type), -1 if there is none
+    first_act = np.where(act.any(axis=1), np.argmax(act, axis=1), -1)
+
+    return {'species_names': list(network.species_names),
+            'n_inputs': len(network.input_species_names),
+            'reg_idx': reg_idx,
+            'reg_type': reg_type,
+            'reg_mask': reg_mask,
+            'act': act,
+            'first_act': first_act,
+            'logic': logic,
+            'prod_gene': prod_gene,
+            'prod_species': prod_species,
+            'P': P,
+            'alpha': alpha,
+            'Kd': reg_Kd,
+            'n': reg_n,
+            'delta': delta,
+            'templates': template_tables}
+
+
+def _expand(a, ndim):
+    # appends singleton axes so that a broadcasts against trailing batch dimensions
+    return a.reshape(a.shape + (1,)*(ndim - a.ndim))
+
+
+def hill_factors(x, tables):
+    # (X/Kd)**n for every regulator of every gene, 0 on padding
+    # negative concentrations (solver overshoots) count as 0, so that non-integer n stays real
+    X = np.maximum(x[tables['reg_idx']], 0)
+    f = (X/_expand(tables['Kd'], X.ndim))**_expand(tables['n'], X.ndim)
+    return np.where(_expand(tables['reg_mask'], X.ndim), f, 0)
+
+
+def gene_rates(x, tables):
+    return factor_rates(hill_factors(x, tables), tables)
+
+
+def factor_rates(f, tables):
+    # expression rates of the genes from the Hill factors of their regulators (genes, regulators, ...)
+    act = _expand(tables['act'], f.ndim)
+
+    down = np.prod(1 + f, axis=1)
+
+    logic = _expand(tables['logic'], down.ndim)
+    up = np.ones_like(down)
+
+    if (tables['logic'] == LOGIC_CODES['and']).any():
+        up_and = np.prod(np.where(act, f, 1), axis=1)
+        up = np.where(logic == LOGIC_CODES['and'], up_and, up)
+
+    if (tables['logic'] == LOGIC_CODES['or']).any():
+        has_act = _expand(tables['act'].any(axis=1), down.ndim)
+        up_or = np.prod(np.where(act, 1 + f, 1), axis=1) - 1
+        up = np.where((logic == LOGIC_CODES['or']) & has_act, up_or, up)
+
+    if (tables['logic'] == LOGIC_CODES['']).any():
+        first = np.maximum(tables['first_act'], 0)
+        up_single = f[np.arange(len(first)), first]
+        up_single = np.where(_expand(tables['first_act'] >= 0, down.ndim), up_single, 1)
+        up = np.where(logic == LOGIC_CODES[''], up_single, up)
+
+    return _expand(tables['alpha'], down.ndim)*up/down
+
+
+def _exclusive_prod(a):
+    # product over the regulator axis, leaving out each entry in turn (no division, safe for zeros)
+    ones = np.ones_like(a[:, :1])
+    before = np.cumprod(np.concatenate([ones, a[:, :-1]], axis=1), axis=1)
+    after = np.cumprod(np.concatenate([ones, a[:, :0:-1]], axis=1), axis=1)[:, ::-1]
+    return before*after
+
+
+def gene_rate_derivatives(x, tables):
+    # d(rate_g)/d(state) for every regulator slot of every gene, x is (species, batch)
+    X = np.maximum(x[tables['reg_idx']], 0)
+    Kd = _expand(tables['Kd'], X.ndim)
+    n = _expand(tables['n'], X.ndim)
+    mask = _expand(tables['reg_mask'], X.ndim)
+    act = _expand(tables['act'], X.ndim)
+    logic = _expand(tables['logic'], X.ndim - 1)
+
+    f = np.where(mask, (X/Kd)**n, 0)
+    df = np.where(mask, n/Kd*(X/Kd)**(n-1), 0)
+
+    down = np.prod(1 + f, axis=1)
+    d_down = _exclusive_prod(1 + f)
+
+    up = np.ones_like(down)
+    d_up = np.zeros_like(f)
+
+    is_and = logic == LOGIC_CODES['and']
+    if is_and.any():
+        a = np.where(act, f, 1)
+        up = np.where(is_and, np.prod(a, axis=1), up)
+        d_up = np.where(is_and[:, None] & act, _exclusive_prod(a), d_up)
+
+    is_or = (logic == LOGIC_CODES['or']) & _expand(tables['act'].any(axis=1), X.ndim - 1)
+    if is_or.any():
+        a = np.where(act, 1 + f, 1)
+        up = np.where(is_or, np.prod(a, axis=1) - 1, up)
+        d_up = np.where(is_or[:, None] & act, _exclusive_prod(a), d_up)
+
+    is_single = (logic == LOGIC_CODES['']) & _expand(tables['first_act'] >= 0, X.ndim - 1)
+    if is_single.any():
+        first = np.maximum(tables['first_act'], 0)
+        is_first = _expand(np.arange(f.shape[1]) == first[:, None], X.ndim)
+        up = np.where(is_single, f[np.arange(len(first)), first], up)
+        d_up = np.where(is_single[:, None] & is_first, 1, d_up)
+
+    alpha = _expand(tables['alpha'], down.ndim)[:, None]
+    return alpha*(d_up*down[:, None] - up[:, None]*d_down)/down[:, None]**2*df
+
+
+def jacobian_sparse(x, tables, P=None):
+    # Jacobian of rhs, for a batch the state is flattened species-major (as in x.reshape(-1))
+    shape = x.shape
+    x = x.reshape(shape[0], -1)
+    n_batch = x.shape[1]
+
+    dr = gene_rate_derivatives(x, tables)
+    mask = tables['reg_mask']
+
+    # (gene, member) x (species, member) derivatives, scattered into the products
+    genes = np.broadcast_to(np.arange(mask.shape[0])[:, None], mask.shape)[mask]
+    regs = tables['reg_idx'][mask]
+    batch = np.arange(n_batch)
+
+    rows = (genes[:, None]*n_batch + batch).ravel()
+    cols = (regs[:, None]*n_batch + batch).ravel()
+    J_genes = sparse.csr_matrix((dr[mask].ravel(), (rows, cols)),
+                                shape=(mask.shape[0]*n_batch, len(tables['species_names'])*n_batch))
+
+    if P is None:
+        P = batch_scatter(tables, n_batch)
+    delta = np.broadcast_to(_expand(tables['delta'], 2), x.shape)
+
+    J = P @ J_genes - sparse.diags(delta.ravel())
+
+    for template in tables['templates']:
+        J = J + template_jacobian(x, template, n_batch)
+
+    return J
+
+
+def template_jacobian(x, template, n_batch):
+    # Jacobian entries of the genes of all instances of a template
+    species_map = template['map']
+    tables = template['tables']
+    dr = gene_rate_derivatives(x[species_map], tables)
+
+    # every (product, regulator slot) pair of the template
+    mask = tables['reg_mask'][tables['prod_gene']]
+    pairs, slots = np.nonzero(mask)
+    genes = tables['prod_gene'][pairs]
+
+    batch = np.arange(n_batch)
+    rows = species_map[tables['prod_species'][pairs]][:, :, None]*n_batch + batch
+    cols = species_map[tables['reg_idx'][genes, slots]][:, :, None]*n_batch + batch
+    vals = dr[genes, slots]
+
+    n = len(x)*n_batch
+    return sparse.csr_matrix((vals.ravel(), (rows.ravel(), cols.ravel())), shape=(n, n))
+
+
+def jacobian(x, tables):
+    return jacobian_sparse(x, tables).toarray()
+
+
+def batch_scatter(tables, n_batch):
+    # product scatter matrix for a species-major flattened batch
+    if n_batch == 1:
+        return tables['P']
+    return sparse.kron(tables['P'], sparse.identity(n_batch), format='csr')
+
+
+def rhs(x, tables):
+    # x has species on the first axis, any trailing axes are evaluated together
+    shape = x.shape
+    x = x.reshape(shape[0], -1)
+
+    dx = tables['P'] @ gene_rates(x, tables)
+    dx = dx - _expand(tables['delta'], 2)*x
+
+    for template in tables['templates']:
+        # template species x instances x batch, the instances are evaluated together
+        species_map = template['map']
+        rates = gene_rates(x[species_map], template['tables'])
+
+        contrib = template['tables']['P'] @ rates.reshape(rates.shape[0], -1)
+        np.add.at(dx, species_map, contrib.reshape(species_map.shape + (x.shape[1],)))
+
+    return dx.reshape(shape)
+
+
+def param_layout(tables):
+    # positions of the parameters in a flat parameter vector [alpha, Kd, n, delta]
+    n_genes = len(tables['alpha'])
+    n_regs = int(tables['reg_mask'].sum())
+    n_species = len(tables['delta'])
+
+    sizes = [('alpha', n_genes), ('Kd', n_regs), ('n', n_regs), ('delta', n_species)]
+    layout = {}
+    start = 0
+    for name, size in sizes:
+        layout[name] = slice(start, start + size)
+        start += size
+
+    return layout
+
+
+def get_params(tables):
+    mask = tables['reg_mask']
+    return np.concatenate([tables['alpha'], tables['Kd'][mask], tables['n'][mask], tables['delta']])
+
+
+def set_params(tables, params):
+    # tables with parameters taken from params, (n_params,) or (n_params, batch)
+    params = np.asarray(params, dtype=float)
+    layout = param_layout(tables)
+    mask = tables['reg_mask']
+    batch = params.shape[1:]
+
+    Kd = np.ones(mask.shape + batch)
+    n = np.ones(mask.shape + batch)
+    Kd[mask] = params[layout['Kd']]
+    n[mask] = params[layout['n']]
+
+    tables = dict(tables)
+    tables['alpha'] = params[layout['alpha']]
+    tables['Kd'] = Kd
+    tables['n'] = n
+    tables['delta'] = params[layout['delta']]
+
+    return tables
+
+
+def compile_ensemble(tables, params):
+    # one model for a whole batch of parameter sets, the state is flattened species-major
+    params = np.asarray(params, dtype=float)
+    n_batch = params.shape[0]
+    n_species = len(tables['delta'])
+
+    tables = set_params(tables, params.T)
+    P = batch_scatter(tables, n_batch)
+
+    model_module = types.ModuleType('grn_ensemble_model')
+    model_module.tables = tables
+    model_module.n_batch = n_batch
+
+    def solve_model(T, state):
+        x = np.asarray(state, dtype=float).reshape(n_species, n_batch)
+        return rhs(x, tables).reshape(-1)
+
+    def jac_model_sparse(T, state):
+        return jacobian_sparse(np.asarray(state, dtype=float).reshape(n_species, n_batch), tables, P).tocsr()
+
+    def jac_model(T, state):
+        return jac_model_sparse(T, state).toarray()
+
+    model_module.solve_model = solve_model
+    model_module.jac_model = jac_model
+    model_module.jac_model_sparse = jac_model_sparse
+
+    return model_module
+
+
+def compile_vectorized(tables):
+    # module-like object with the same interface as a generated model
+    model_module = types.ModuleType('grn_vectorized_model')
+    model_module.tables = tables
+
+    def solve_model(T, state):
+        return rhs(np.asarray(state, dtype=float), tables)
+
+    def solve_model_steady(state):
+        return solve_model(0, state)
+
+    def jac_model(T, state):
+        return jacobian(np.asarray(state, dtype=float), tables)
+
+    def jac_model_sparse(T, state):
+        return jacobian_sparse(np.asarray(state, dtype=float), tables).tocsr()
+
+    model_module.solve_model = solve_model
+    model_module.solve_model_steady = solve_model_steady
+    model_module.jac_model = jac_model
+    model_module.jac_model_sparse = jac_model_sparse
+
+    return model_module
@@ -0,0 +1,178 @@
+import numpy as np
+import kernels, simulator, helpers
+
+
+# Logic-level surrogate of a grn: every species is either low or high and every gene is thresholded into a
+# lookup table of its expression rate over the low/high states of its regulators, a sequence of inputs
+# is then simulated by updating the species until nothing changes (a few table lookups per step instead of
+# an ODE integration)
+
+
+def species_levels(tables, in_level=100, t_single=100, iterations=50, tol=1e-9):
+    # low and high level of every species, inputs are 0 or in_level
+    # the levels of the other species are the smallest and largest production over the low/high states of
+    # their regulators over their decay (species without decay accumulate for t_single), narrowed from
+    # [0, alpha/delta] until they do not change
+    n_inputs = tables['n_inputs']
+    delta = tables['delta']
+
+    def level(production):
+        return np.where(delta > 0, production/np.where(delta > 0, delta, 1), production*t_single)
+
+    lo = level(np.zeros(len(delta)))
+    hi = level(tables['P'] @ tables['alpha'])
+    lo[:n_inputs] = 0
+    hi[:n_inputs] = in_level
+
+    for _ in range(iterations):
+        rates = rate_tables(tables, lo, hi)
+        new_lo = level(tables['P'] @ rates.min(axis=1))
+        new_hi = level(tables['P'] @ rates.max(axis=1))
+        new_lo[:n_inputs] = lo[:n_inputs]
+        new_hi[:n_inputs] = hi[:n_inputs]
+
+        converged = np.allclose(new_lo, lo, rtol=tol, atol=tol) and np.allclose(new_hi, hi, rtol=tol, atol=tol)
+        lo, hi = new_lo, new_hi
+        if converged:
+            break
+
+    return lo, hi
+
+
+def rate_tables(tables, lo, hi):
+    # expression rate of every gene for every low/high state of its regulators (genes, 2**regulators),
+    # bit j of the state is regulator slot j
+    n_slots = tables['reg_idx'].shape[1]
+    states = np.arange(2**n_slots)
+    bits = (states[None, :] >> np.arange(n_slots)[:, None]) & 1
+
+    X = np.where(bits[None, :, :] == 1, hi[tables['reg_idx']][:, :, None], lo[tables['reg_idx']][:, :, None])
+    f = np.where(tables['reg_mask'][:, :, None], (X/tables['Kd'][:, :, None])**tables['n'][:, :, None], 0)
+
+    return kernels.factor_rates(f, tables)
+
+
+def build_logic(network, in_level=100, t_single=100, tables=None):
+    # lookup tables of the surrogate, for inputs of 0 or in_level
+    # tables - kernels.build_tables of the network (e.g. the tables of a topology with the parameters of a
+    #          candidate set by kernels.set_params), built from the network if not given
+    if tables is None:
+        tables = kernels.build_tables(network)
+    lo, hi = species_levels(tables, in_level, t_single)
+    rates = rate_tables(tables, lo, hi)
+
+    n_inputs = tables['n_inputs']
+    n_species = len(tables['species_names'])
+    reg_counts = tables['reg_mask'].sum(axis=1)
+
+    # genes producing every species and the regulators of every gene, as lists for fast scalar lookups
+    producers = [[] for _ in range(n_species)]
+    for g, s in zip(tables['prod_gene'], tables['prod_species']):
+        producers[s].append(int(g))
+
+    return {'species_names': tables['species_names'],
+            'n_inputs': n_inputs,
+            'in_level': in_level,
+            't_single': t_single,
+            'lo': lo,
+            'hi': hi,
+            'threshold': (lo + hi)/2,
+            'delta': tables['delta'],
+            'rates': rates.tolist(),
+            'regulators': [tables['reg_idx'][g, :reg_counts[g]].tolist() for g in range(len(reg_counts))],
+            'producers': producers}
+
+
+def settle(logic, bits, base, reverse=False, max_sweeps=None):
+    # updates the non-input species one after another (in species order, or reversed) until no state
+    # changes, returns the levels of the species and whether the states settled
+    # (cross-coupled latches would oscillate with all species updated at once, the order decides which
+    # state a self-latched latch starts in)
+    # base - levels at the start of the step, species without decay add their production to it
+    n_inputs = logic['n_inputs']
+    rates = logic['rates']
+    regulators = logic['regulators']
+    producers = logic['producers']
+    threshold = logic['threshold']
+    delta = logic['delta']
+    t_single = logic['t_single']
+
+    if max_sweeps is None:
+        max_sweeps = 2*len(bits)
+
+    def level(s):
+        total = 0.0
+        for g in producers[s]:
+            state = 0
+            for j, r in enumerate(regulators[g]):
+                state |= bits[r] << j
+            total += rates[g][state]
+        return total/delta[s] if delta[s] > 0 else base[s] + total*t_single
+
+    order = range(n_inputs, len(bits))
+    if reverse:
+        order = order[::-1]
+
+    settled = False
+    for _ in range(max_sweeps):
+        changed = False
+        for s in order:
+            bit = int(level(s) > threshold[s])
+            if bit != bits[s]:
+                bits[s] = bit
+                changed = True
+
+        if not changed:
+            settled = True
+            break
+
+    levels = np.array([level(s) for s in range(len(bits))])
+    levels[:n_inputs] = base[:n_inputs]
+
+    return levels, settled
+
+
+def simulate_logic(network, IN_seq, INS_factor=1, t_single=100, sampling='all', observe=None, logic=None, reverse=False):
+    # surrogate of simulator.simulate_sequence, with the same output (T, Y)
+    # every step holds the levels the species settle to, all non-input species start low
+    # logic - tables from build_logic (built for the inputs of IN_seq if not given)
+    # reverse - species are updated in reverse order, which starts self-latched latches in the other state
+    X = np.array([np.atleast_1d(IN) for IN in IN_seq], dtype=np.float64)*INS_factor
+
+    if logic is None:
+        logic = build_logic(network, np.max(X, initial=0), t_single)
+
+    n_inputs = logic['n_inputs']
+    observed = simulator.observed_indices(network, observe)
+    T1 = simulator.sample_times(t_single, sampling)
+
+    T = np.zeros(len(X)*len(T1))
+    Y = np.zeros((len(X)*len(T1), len(observed)))
+    bits = [0]*len(logic['species_names'])
+    S = np.zeros(len(bits))
+
+    for i, X0 in enumerate(X):
+        S[:n_inputs] = X0
+        bits[:n_inputs] = (X0 > logic['threshold'][:n_inputs]).astype(int).tolist()
+        S, _ = settle(logic, bits, S, reverse)
+
+        T[i*len(T1):(i+1)*len(T1)] = T1 + i*t_single
+        Y[i*len(T1):(i+1)*len(T1)] = S[observed]
+
+    return T, Y
+
+
+def score_logic(network, IN_seq, truth, columns, INS_factor=1, t_single=100, sampling='all', tables=None):
+    # sum over the columns of the MSE of the surrogate against truth ((columns,) time), as in
+    # simulator.score_sequence, for the better of the two starting states of self-latched latches
+    # (the ODE starts them on a saddle and the state they fall into is not known in advance)
+    # tables - tables of the network for build_logic
+    columns = [columns] if np.ndim(columns) == 0 else list(columns)
+    logic = build_logic(network, np.max(np.asarray(IN_seq, dtype=np.float64)*INS_factor, initial=0), t_single, tables)
+
+    scores = []
+    for reverse in (False, True):
+        _, Y = simulate_logic(network, IN_seq, INS_factor, t_single, sampling, columns, logic, reverse)
+        scores.append(np.sum(helpers.trajectory_mse(Y, truth, np.arange(len(columns)))))
+
+    return min(scores)
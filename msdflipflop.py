@@ -137,17 +137,32 @@ def registercell(name, network, clkname=None, inputname=None, decays=None, Kds=N
     network.add_gene(10, qbar_reg, [{"name": f"{name}_QBAR"}], logic_type="or")
 
 
+def celltemplate(decays=None, Kds=None, ns=None):
+
+    # Flip-flop with ports CLK and D, to be added to a network with grn.add_instance
+    # Instance species are named prefix + "_MNAND1", ... like the ones from registercell
+    template = grn.grn()
+    template.add_input_species("CLK")
+    template.add_input_species("D")
+    registercell("", template, "CLK", "D", decays, Kds, ns)
+
+    return template
+
+
 def truthgenerator(clks):
-    
-    # Extract rising edges
-    pts = [0] + [i for i in range(len(clks)-1) if clks[i+1]-clks[i]==100] + [len(clks)-1]
-    truth = np.array([])
 
-    # Construct ground truth based on rising edges
-    for p in range(len(pts)-1):
-        truth = np.concatenate([truth, np.repeat(100-(100 if len(truth)==0 else truth[-1]), pts[p+1]-pts[p])])
-    return np.concatenate([[clks[0]], truth])
+    clks = np.asarray(clks)
+
+    # Extract rising edges, an edge at the very start does not change the output
+    rising = np.flatnonzero(np.diff(clks) == 100)
+    rising = rising[rising > 0]
+
+    # Construct ground truth, the output toggles at every rising edge (parity of the edges so far)
+    toggles = np.zeros(max(len(clks)-1, 0), dtype=np.int64)
+    toggles[rising] = 1
+    truth = 100.0*(np.cumsum(toggles) % 2)
 
+    return np.concatenate([clks[:1], truth])
 
 
 if __name__ == "__main__":
@@ -1,6 +1,10 @@
 import pygad
 import grn
 import simulator
+import helpers
+import profiling
+import logic
+import kernels
 import msdflipflop
 import numpy as np
 import tqdm
@@ -19,6 +23,39 @@ CROSSOVER_TYPE = "uniform"
 MUTATION_TYPE = "random"
 MUTATION_PROBABILITY = 0.3
 
+# Simulate each generation as one stacked system (see simulator.simulate_ensemble, stacked=True) instead of
+# candidate by candidate, faster but the candidates share the solver's steps, so a fitness can differ slightly
+# with the rest of the batch (a latch started on a saddle may even fall into the other state)
+ENSEMBLE = False
+
+# Number of worker processes for fitness evaluation (None evaluates serially)
+WORKERS = None
+
+# Fitness cache size and file to keep it between runs (None keeps it in memory only)
+CACHE_SIZE = 100000
+CACHE_FILE = None
+
+# Per-generation profile of the simulations, printed after the run and saved to PROFILE_FILE if given
+# (only evaluations in this process are profiled, use WORKERS = None)
+PROFILE = False
+PROFILE_FILE = None
+
+# Stop simulating a candidate as soon as its error is worse than the worst parent of the last generation,
+# its fitness is then a bound, which is not cached (only for candidate by candidate evaluation, with WORKERS
+# nothing computed in the workers is cached, this process cannot tell their bounds from exact values)
+EARLY_ABORT = False
+
+# Compile the topology of the cell once and only fill in the parameters of every candidate
+# (see grn.parameter_map), instead of generating a model for every candidate
+PARAMETRIC = False
+
+# Screen candidates with the logic-level surrogate (see logic.py) before simulating them, a candidate whose
+# logic-level error is above SCREEN_BOUND is not simulated and gets -SCREEN_PENALTY as its score, below
+# the score of every simulated candidate (only for candidate by candidate evaluation)
+SCREEN = False
+SCREEN_BOUND = 4000
+SCREEN_PENALTY = 1e20
+
 # Gene value pool initialization
 DECAY_VALUES = np.array([0, 0.1, 0.2, 0.5])
 KD_VALUES = np.array([0.1, 0.2, 0.5, 1, 2, 5, 10])
@@ -30,6 +67,9 @@ DECAY_GENES = 8
 KD_GENES = 2
 N_GENES = 2
 
+# Simulation time of a single clock step
+T_SINGLE = 250
+
 # Clock inputs, data inputs and ground truth to test the cell behavior
 clks = np.concat([np.repeat(0, 5),[100 if i%4==0 else 0 for i in range(10)]])
 data = None
@@ -38,60 +78,163 @@ data = None
 # ALGORITHM PREPARATION
 # ------------------------
 
-# Fitness function - determining how good a solution is
-def fitness_func(ga_instance, solution, solution_idx):
+# Inputs of the screening and early abort and their ground truth
+IN_seq = clks if not data else [(data[i], clks[i]) for i in range(len(clks))]
+truth = msdflipflop.truthgenerator(simulator.input_trajectory(IN_seq, T_SINGLE)[:, 0])
+
+# Cell parameters described by a solution
+def cell_arguments(solution):
 
     sol = solution.astype(np.int32)
 
-    # Preparation of parameters
     decays = [DECAY_VALUES[i] for i in sol[0:DECAY_GENES]]
     Kds = [KD_VALUES[i] for i in sol[DECAY_GENES:DECAY_GENES+KD_GENES]]
     ns = [N_VALUES[i] for i in sol[DECAY_GENES+KD_GENES:]]
 
+    return {'decays': decays, 'Kds': Kds, 'ns': ns}
+
+# Adds the flip-flop to a network
+def add_cell(cell, decays, Kds, ns):
+
+    if not data:
+        msdflipflop.registercell("cell", cell, inputname="cell_QBAR", decays=decays, Kds=Kds, ns=ns)
+    else:
+        msdflipflop.registercell("cell", cell, decays=decays, Kds=Kds, ns=ns)
+
+# Builds the flip-flop described by a solution
+def build_cell(solution):
+
     cell = grn.grn()
+    add_cell(cell, **cell_arguments(solution))
+
+    return cell
+
+# Parametric model of the cell topology, its tables (see kernels.build_tables) and where the cell parameters
+# go in its parameter vector, built on first use
+parametric = {}
+
+def parametric_cell():
+
+    if not parametric:
+        parametric.update(grn.parameter_map(add_cell, **cell_arguments(np.zeros(DECAY_GENES + KD_GENES + N_GENES))))
+        parametric['model'] = parametric['network'].compile_parametric_model(parametric['ties'])
+        parametric['tables'] = kernels.build_tables(parametric['network'])
+
+    return parametric
+
+# Network and model of a solution, with PARAMETRIC the network only gives the topology
+def build_model(solution):
+
+    if not PARAMETRIC:
+        return build_cell(solution), False
+
+    cell = parametric_cell()
+    return cell['network'], grn.bind_params(cell['model'], grn.fill_params(cell, **cell_arguments(solution)))
+
+# Fitness function - determining how good a solution is
+def fitness_func(ga_instance, solution, solution_idx):
+
+    cell, model = build_model(solution)
+
+    # Candidates that fail at the logic level are not simulated, with PARAMETRIC the surrogate is built from
+    # the tables of the topology with the parameters of the candidate
+    if SCREEN:
+        tables = kernels.set_params(parametric_cell()['tables'], model.params) if PARAMETRIC else None
+        score = logic.score_logic(cell, IN_seq, truth, [7] if not data else [8], t_single = T_SINGLE, tables = tables)
+        if score > SCREEN_BOUND:
+            return -SCREEN_PENALTY
+
+    # Scoring segment by segment against the ground truth of the clock inputs, the score of an aborted
+    # candidate is only a bound and is not cached
+    if EARLY_ABORT:
+        score, complete = simulator.score_sequence(cell, IN_seq, truth, [7] if not data else [8], helpers.abort_bound(ga_instance), model, t_single = T_SINGLE)
+        return -score, complete
 
     # Simulating the cell using given clock and input data, return MSE of Q vs. ground truth
     if not data:
-        msdflipflop.registercell("cell", cell, inputname="cell_QBAR", decays=decays, Kds=Kds, ns=ns)
-        _, Y = simulator.simulate_sequence(cell, clks, t_single = 250, plot_on=False)
+        _, Y = simulator.simulate_sequence(cell, clks, model, t_single = T_SINGLE, plot_on=False)
         gt = msdflipflop.truthgenerator(Y[:, 0])
-        return -np.mean((Y[:, 7]-gt)**2) #- np.mean((Y[:, 8]-(100-gt))**2)
+        return -helpers.trajectory_mse(Y, gt, 7) #- np.mean((Y[:, 8]-(100-gt))**2)
 
     else:
-        msdflipflop.registercell("cell", cell, decays=decays, Kds=Kds, ns=ns)
-        _, Y = simulator.simulate_sequence(cell, [(data[i], clks[i]) for i in range(len(clks))], t_single = 250, plot_on=False)
+        _, Y = simulator.simulate_sequence(cell, [(data[i], clks[i]) for i in range(len(clks))], model, t_single = T_SINGLE, plot_on=False)
         gt = msdflipflop.truthgenerator(Y[:, 0])
-        return -np.mean((Y[:, 8]-gt)**2) #- np.mean((Y[:, 9]-(100-gt))**2)
+        return -helpers.trajectory_mse(Y, gt, 8) #- np.mean((Y[:, 9]-(100-gt))**2)
+
+# Batch fitness function - simulates the whole batch of solutions as one stacked system on a single topology
+def fitness_func_batch(ga_instance, solutions, solution_indices):
+
+    if PARAMETRIC:
+        cells = [parametric_cell()['network']]
+        params = np.array([grn.fill_params(parametric_cell(), **cell_arguments(solution)) for solution in solutions])
+    else:
+        cells = [build_cell(solution) for solution in solutions]
+        params = np.array([cell.get_params() for cell in cells])
+
+    # All cells share the topology, only the parameters differ
+    if not data:
+        _, Y = simulator.simulate_ensemble(cells[0], params, clks, t_single = T_SINGLE, stacked = True)
+        gt = msdflipflop.truthgenerator(Y[0, :, 0])
+        return (-helpers.trajectory_mse(Y, gt, 7)).tolist()
+
+    else:
+        _, Y = simulator.simulate_ensemble(cells[0], params, [(data[i], clks[i]) for i in range(len(clks))], t_single = T_SINGLE, stacked = True)
+        gt = msdflipflop.truthgenerator(Y[0, :, 0])
+        return (-helpers.trajectory_mse(Y, gt, 8)).tolist()
+
+
 
+# Cache of fitness values, keyed by the solution and everything the fitness depends on
+# (with SCREEN the values of screened candidates are not simulated and with ENSEMBLE they come from the stacked
+# solve, they are not shared with runs without them)
+fingerprint = helpers.fingerprint(clks, data, T_SINGLE, DECAY_VALUES, KD_VALUES, N_VALUES, DECAY_GENES, KD_GENES, N_GENES, SCREEN, SCREEN_BOUND, SCREEN_PENALTY, ENSEMBLE)
+cache = helpers.FitnessCache(fingerprint, CACHE_SIZE, CACHE_FILE)
+profiler = profiling.GAProfiler()
 
 
 # ------------------------
 # RUNNING THE ALGORITHM
 # ------------------------
 
-ga_instance = pygad.GA(num_generations=GENERATIONS,
-                    sol_per_pop=POPULATION_SIZE,
-                    num_parents_mating=PARENTS_MATING,
-                    num_genes=DECAY_GENES + KD_GENES + N_GENES,
-                    gene_space=np.repeat([range(len(DECAY_VALUES))], DECAY_GENES, axis=0).tolist()
-                                + np.repeat([range(len(KD_VALUES))], KD_GENES, axis=0).tolist()
-                                + np.repeat([range(len(N_VALUES))], N_GENES, axis=0).tolist(),
-                    fitness_func=fitness_func,
-                    parent_selection_type=PARENT_SELECTION_TYPE,
-                    keep_parents=KEEP_PARENTS,
-                    crossover_type=CROSSOVER_TYPE,
-                    mutation_type=MUTATION_TYPE,
-                    mutation_probability=MUTATION_PROBABILITY)
-
-ga_instance.run()
-
-temp1 = np.array([DECAY_GENES, KD_GENES, N_GENES])
-temp2 = [np.sum(temp1[:i+1]) for i in range(len(temp1))]
-solution, solution_fitness, solution_idx = ga_instance.best_solution()
-print(("Parameters of the best solution :\n" +
-       "Decay values: {decays}\n" +
-       "Kd values: {Kds}\n" +
-       "n values: {ns}").format(decays=DECAY_VALUES[solution[:temp2[0]].astype(np.int32)].tolist(),
-                                Kds=KD_VALUES[solution[temp2[0]:temp2[1]].astype(np.int32)].tolist(),
-                                ns=N_VALUES[solution[temp2[1]:].astype(np.int32)].tolist()))
-print("Fitness value of the best solution = {solution_fitness}".format(solution_fitness=solution_fitness))
\ No newline at end of file
+if __name__ == "__main__":
+
+    fitness = cache.wrap_batch(fitness_func_batch) if ENSEMBLE else cache.wrap(fitness_func)
+    if PROFILE:
+        fitness = profiler.wrap(fitness)
+
+    ga_instance = pygad.GA(num_generations=GENERATIONS,
+                        sol_per_pop=POPULATION_SIZE,
+                        num_parents_mating=PARENTS_MATING,
+                        num_genes=DECAY_GENES + KD_GENES + N_GENES,
+                        gene_space=np.repeat([range(len(DECAY_VALUES))], DECAY_GENES, axis=0).tolist()
+                                    + np.repeat([range(len(KD_VALUES))], KD_GENES, axis=0).tolist()
+                                    + np.repeat([range(len(N_VALUES))], N_GENES, axis=0).tolist(),
+                        fitness_func=fitness,
+                        on_fitness=cache.on_fitness if not (EARLY_ABORT and WORKERS) else None,
+                        on_generation=profiler.on_generation if PROFILE else None,
+                        fitness_batch_size=(-(-POPULATION_SIZE // WORKERS) if WORKERS else POPULATION_SIZE) if ENSEMBLE else None,
+                        parallel_processing=["process", WORKERS] if WORKERS else None,
+                        parent_selection_type=PARENT_SELECTION_TYPE,
+                        keep_parents=KEEP_PARENTS,
+                        crossover_type=CROSSOVER_TYPE,
+                        mutation_type=MUTATION_TYPE,
+                        mutation_probability=MUTATION_PROBABILITY)
+
+    ga_instance.run()
+    cache.save()
+
+    if PROFILE:
+        print(profiler.report())
+        if PROFILE_FILE:
+            profiler.save(PROFILE_FILE)
+
+    temp1 = np.array([DECAY_GENES, KD_GENES, N_GENES])
+    temp2 = [np.sum(temp1[:i+1]) for i in range(len(temp1))]
+    solution, solution_fitness, solution_idx = ga_instance.best_solution()
+    print(("Parameters of the best solution :\n" +
+           "Decay values: {decays}\n" +
+           "Kd values: {Kds}\n" +
+           "n values: {ns}").format(decays=DECAY_VALUES[solution[:temp2[0]].astype(np.int32)].tolist(),
+                                    Kds=KD_VALUES[solution[temp2[0]:temp2[1]].astype(np.int32)].tolist(),
+                                    ns=N_VALUES[solution[temp2[1]:].astype(np.int32)].tolist()))
+    print("Fitness value of the best solution = {solution_fitness}".format(solution_fitness=solution_fitness))
\ No newline at end of file
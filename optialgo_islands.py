@@ -0,0 +1,105 @@
+import optialgo_reg
+import numpy as np
+import multiprocessing
+import queue
+
+# ------------------------
+# HYPERPARAMETERS
+# ------------------------
+
+# Number of islands, every island is an independent population of optialgo_reg (same settings and fitness)
+# evolved in its own process
+ISLANDS = 4
+
+# Generations of every island
+GENERATIONS = 20
+
+# Every MIGRATION_INTERVAL generations each island sends its MIGRANTS best solutions to the next island
+# (in a ring), where they replace the worst ones
+MIGRATION_INTERVAL = 5
+MIGRANTS = 2
+
+# Seed of the first island, the others use the following seeds (None for random runs)
+SEED = None
+
+# Seconds to wait for the migrants of the previous island before giving up on it
+MIGRATION_TIMEOUT = 3600
+
+# ------------------------
+# ALGORITHM PREPARATION
+# ------------------------
+
+# Sends the best solutions to the next island and replaces the worst ones with the migrants of the previous
+# island, called after every generation (the population and its fitness are then those of the next generation)
+def migration(inbox, outbox):
+
+    def on_generation(ga_instance):
+        if ga_instance.generations_completed % MIGRATION_INTERVAL != 0 or ga_instance.generations_completed >= GENERATIONS:
+            return
+
+        fitness = np.asarray(ga_instance.last_generation_fitness)
+        order = np.argsort(fitness)
+        best = order[-MIGRANTS:]
+        worst = order[:MIGRANTS]
+
+        outbox.put((ga_instance.population[best].copy(), fitness[best].copy()))
+
+        try:
+            migrants, migrants_fitness = inbox.get(timeout=MIGRATION_TIMEOUT)
+        except queue.Empty:
+            return
+
+        # the migrants' fitness is known, so they are not evaluated again
+        ga_instance.population[worst] = migrants
+        ga_instance.last_generation_fitness[worst] = migrants_fitness
+
+    return on_generation
+
+# Evolves one island and reports its best solution
+def island(index, inbox, outbox, results):
+
+    try:
+        ga_instance = optialgo_reg.create_ga(num_generations=GENERATIONS,
+                                             on_generation=migration(inbox, outbox),
+                                             random_seed=None if SEED is None else SEED + index)
+        ga_instance.run()
+    except:
+        # the main process waits for a result of every island
+        results.put((index, None, -np.inf))
+        raise
+
+    solution, solution_fitness, _ = ga_instance.best_solution(ga_instance.last_generation_fitness)
+    results.put((index, solution, solution_fitness))
+
+def run(islands=ISLANDS):
+    # one inbox per island, island i sends its migrants to island i+1
+    inboxes = [multiprocessing.Queue() for _ in range(islands)]
+    results = multiprocessing.Queue()
+
+    processes = [multiprocessing.Process(target=island, args=(i, inboxes[i], inboxes[(i+1) % islands], results))
+                 for i in range(islands)]
+    for process in processes:
+        process.start()
+
+    # results are read before joining, a process does not exit while its queue data is not consumed
+    best = sorted([results.get() for _ in processes], key=lambda result: result[0])
+    for process in processes:
+        process.join()
+
+    return best
+
+
+# ------------------------
+# RUNNING THE ALGORITHM
+# ------------------------
+
+if __name__ == "__main__":
+
+    best = run()
+
+    for index, solution, solution_fitness in best:
+        print(f"Island {index}: fitness {solution_fitness}")
+
+    index, solution, solution_fitness = max(best, key=lambda result: result[2])
+    print(f"Best island: {index}")
+    optialgo_reg.print_solution(solution, solution_fitness)
@@ -1,6 +1,10 @@
 import pygad
 import grn
 import simulator
+import helpers
+import profiling
+import logic
+import kernels
 import counter2m
 import numpy as np
 import tqdm
@@ -22,6 +26,34 @@ CROSSOVER_TYPE = "uniform"
 MUTATION_TYPE = "random"
 MUTATION_PROBABILITY = 0.1
 
+# Number of worker processes for fitness evaluation (None evaluates serially)
+WORKERS = None
+
+# Fitness cache size and file to keep it between runs (None keeps it in memory only)
+CACHE_SIZE = 100000
+CACHE_FILE = None
+
+# Per-generation profile of the simulations, printed after the run and saved to PROFILE_FILE if given
+# (only evaluations in this process are profiled, use WORKERS = None)
+PROFILE = False
+PROFILE_FILE = None
+
+# Stop simulating a candidate as soon as its error is worse than the worst parent of the last generation,
+# its fitness is then a bound, which is not cached (only for candidate by candidate evaluation, with WORKERS
+# nothing computed in the workers is cached, this process cannot tell their bounds from exact values)
+EARLY_ABORT = False
+
+# Compile the topology of the counter once and only fill in the parameters of every candidate
+# (see grn.parameter_map), instead of generating a model for every candidate
+PARAMETRIC = False
+
+# Screen candidates with the logic-level surrogate (see logic.py) before simulating them, a candidate whose
+# logic-level error is above SCREEN_BOUND is not simulated and gets -SCREEN_PENALTY as its score, below
+# the score of every simulated candidate (only for candidate by candidate evaluation)
+SCREEN = False
+SCREEN_BOUND = 25000
+SCREEN_PENALTY = 1e20
+
 # Gene value pool initialization
 CELL_DECAY_VALUES = np.array([0, 0.1, 0.2, 0.5])
 CELL_KD_VALUES = np.array([0.1, 0.2, 0.5, 1, 2, 5, 10])
@@ -39,6 +71,9 @@ INSTR_DECAY_GENES = 1
 CONN_KD_GENES = 2
 CONN_N_GENES = 2
 
+# Simulation time of a single clock step
+T_SINGLE = 250
+
 # Clock inputs and ground truth to test the cell behavior
 clks = np.concat([np.repeat(0, 5),[100 if i%4==0 else 0 for i in range(13)]])
 
@@ -46,40 +81,106 @@ clks = np.concat([np.repeat(0, 5),[100 if i%4==0 else 0 for i in range(13)]])
 # ALGORITHM PREPARATION
 # ------------------------
 
-# Fitness function - determining how good a solution is
-def fitness_func(ga_instance, solution, solution_idx):
+# Ground truth of the clock inputs and the outputs it is scored on in the screening and early abort
+truth = counter2m.truthgenerator(simulator.input_trajectory(clks, T_SINGLE)[:, 0], D)
+instructions = [f"INSTRUCTION_{i}" for i in range(1, 2*D+1)]
+
+# Counter parameters described by a solution
+def register_arguments(solution):
 
     sol = solution.astype(np.int32)
 
-    # Preparation of parameters
     temp1 = np.array([CELL_DECAY_GENES, CELL_KD_GENES, CELL_N_GENES, INSTR_DECAY_GENES, CONN_KD_GENES, CONN_N_GENES])
     temp2 = [np.sum(temp1[:i+1]) for i in range(len(temp1))]
-    cell_decays = [CELL_DECAY_VALUES[i] for i in sol[0:temp2[0]]]
-    cell_Kds = [CELL_KD_VALUES[i] for i in sol[temp2[0]:temp2[1]]]
-    cell_ns = [CELL_N_VALUES[i] for i in sol[temp2[1]:temp2[2]]]
-    instr_decays=[INSTR_DECAY_VALUES[i] for i in sol[temp2[2]:temp2[3]]]
-    conn_Kds=[CONN_KD_VALUES[i] for i in sol[temp2[3]:temp2[4]]]
-    conn_ns=[CONN_N_VALUES[i] for i in sol[temp2[4]:]]
 
-    register = grn.grn()
+    return {'cell_decays': [CELL_DECAY_VALUES[i] for i in sol[0:temp2[0]]],
+            'cell_Kds': [CELL_KD_VALUES[i] for i in sol[temp2[0]:temp2[1]]],
+            'cell_ns': [CELL_N_VALUES[i] for i in sol[temp2[1]:temp2[2]]],
+            'instr_decays': [INSTR_DECAY_VALUES[i] for i in sol[temp2[2]:temp2[3]]],
+            'conn_Kds': [CONN_KD_VALUES[i] for i in sol[temp2[3]:temp2[4]]],
+            'conn_ns': [CONN_N_VALUES[i] for i in sol[temp2[4]:]]}
+
+# Adds the counter to a network
+def add_register(register, cell_decays, cell_Kds, cell_ns, instr_decays, conn_Kds, conn_ns):
 
     counter2m.counterregister(register, D, None, cell_decays, cell_Kds, cell_ns, instr_decays, conn_Kds, conn_ns)
-    _, Y = simulator.simulate_sequence(register, clks, t_single = 250, plot_on=False)
+
+# Builds the counter described by a solution
+def build_register(solution):
+
+    register = grn.grn()
+    add_register(register, **register_arguments(solution))
+
+    return register
+
+# Parametric model of the counter topology, its tables (see kernels.build_tables) and where the counter
+# parameters go in its parameter vector, built on first use
+parametric = {}
+
+def parametric_register():
+
+    if not parametric:
+        n_genes = CELL_DECAY_GENES + CELL_KD_GENES + CELL_N_GENES + INSTR_DECAY_GENES + CONN_KD_GENES + CONN_N_GENES
+        parametric.update(grn.parameter_map(add_register, **register_arguments(np.zeros(n_genes))))
+        parametric['model'] = parametric['network'].compile_parametric_model(parametric['ties'])
+        parametric['tables'] = kernels.build_tables(parametric['network'])
+
+    return parametric
+
+# Network and model of a solution, with PARAMETRIC the network only gives the topology
+def build_model(solution):
+
+    if not PARAMETRIC:
+        return build_register(solution), False
+
+    register = parametric_register()
+    return register['network'], grn.bind_params(register['model'], grn.fill_params(register, **register_arguments(solution)))
+
+# Fitness function - determining how good a solution is
+def fitness_func(ga_instance, solution, solution_idx):
+
+    register, model = build_model(solution)
+
+    # Candidates that fail at the logic level are not simulated, with PARAMETRIC the surrogate is built from
+    # the tables of the topology with the parameters of the candidate
+    if SCREEN:
+        tables = kernels.set_params(parametric_register()['tables'], model.params) if PARAMETRIC else None
+        score = logic.score_logic(register, clks, truth, instructions, t_single = T_SINGLE, tables = tables)
+        if score > SCREEN_BOUND:
+            return -SCREEN_PENALTY
+
+    # Scoring segment by segment against the ground truth of the clock inputs, the score of an aborted
+    # candidate is only a bound and is not cached
+    if EARLY_ABORT:
+        score, complete = simulator.score_sequence(register, clks, truth, instructions, helpers.abort_bound(ga_instance), model, t_single = T_SINGLE)
+        return -score, complete
+
+    # Only the clock and the instruction outputs are recorded
+    observe = ["CLK"] + [f"INSTRUCTION_{i}" for i in range(1, 2*D+1)]
+    _, Y = simulator.simulate_sequence(register, clks, model, t_single = T_SINGLE, plot_on=False, observe=observe)
     ground_truth = counter2m.truthgenerator(Y[:, 0], D)
-    
-    err = 0
-    for i in range(-2*D, 0):
-        err += -np.mean((Y[:, i]-ground_truth[i+2*D])**2)
-    
-    return err 
+
+    # MSE of every instruction output against its ground truth
+    return -sum(helpers.trajectory_mse(Y, ground_truth, np.arange(-2*D, 0)))
+
 
 
+# Cache of fitness values, keyed by the solution and everything the fitness depends on
+# (with SCREEN the values of screened candidates are not simulated, they are not shared with runs without it)
+fingerprint = helpers.fingerprint(clks, D, T_SINGLE, CELL_DECAY_VALUES, CELL_KD_VALUES, CELL_N_VALUES, INSTR_DECAY_VALUES, CONN_KD_VALUES, CONN_N_VALUES,
+                                  CELL_DECAY_GENES, CELL_KD_GENES, CELL_N_GENES, INSTR_DECAY_GENES, CONN_KD_GENES, CONN_N_GENES, SCREEN, SCREEN_BOUND,
+                                  SCREEN_PENALTY)
+cache = helpers.FitnessCache(fingerprint, CACHE_SIZE, CACHE_FILE)
+profiler = profiling.GAProfiler()
+
 
 # ------------------------
 # RUNNING THE ALGORITHM
 # ------------------------
 
-ga_instance = pygad.GA(num_generations=GENERATIONS,
+# Genetic algorithm over the counter parameters, keyword arguments override the settings above
+def create_ga(**kwargs):
+    settings = dict(num_generations=GENERATIONS,
                     sol_per_pop=POPULATION_SIZE,
                     num_parents_mating=PARENTS_MATING,
                     num_genes=CELL_DECAY_GENES + CELL_KD_GENES + CELL_N_GENES + INSTR_DECAY_GENES + CONN_KD_GENES + CONN_N_GENES,
@@ -89,28 +190,48 @@ ga_instance = pygad.GA(num_generations=GENERATIONS,
                                 + np.repeat([range(len(INSTR_DECAY_VALUES))], INSTR_DECAY_GENES, axis=0).tolist()
                                 + np.repeat([range(len(CONN_KD_VALUES))], CONN_KD_GENES, axis=0).tolist()
                                 + np.repeat([range(len(CONN_N_VALUES))], CONN_N_GENES, axis=0).tolist(),
-                    fitness_func=fitness_func,
+                    fitness_func=profiler.wrap(cache.wrap(fitness_func)) if PROFILE else cache.wrap(fitness_func),
+                    on_fitness=cache.on_fitness if not (EARLY_ABORT and WORKERS) else None,
+                    on_generation=profiler.on_generation if PROFILE else None,
+                    parallel_processing=["process", WORKERS] if WORKERS else None,
                     parent_selection_type=PARENT_SELECTION_TYPE,
                     keep_parents=KEEP_PARENTS,
                     crossover_type=CROSSOVER_TYPE,
                     mutation_type=MUTATION_TYPE,
                     mutation_probability=MUTATION_PROBABILITY)
+    settings.update(kwargs)
+
+    return pygad.GA(**settings)
 
-ga_instance.run()
-
-temp1 = np.array([CELL_DECAY_GENES, CELL_KD_GENES, CELL_N_GENES, INSTR_DECAY_GENES, CONN_KD_GENES, CONN_N_GENES])
-temp2 = [np.sum(temp1[:i+1]) for i in range(len(temp1))]
-solution, solution_fitness, solution_idx = ga_instance.best_solution()
-print(("Parameters of the best solution :\n" +
-       "Cell decay values: {cedecay}\n" +
-       "Cell Kd values: {ceKds}\n" +
-       "Cell n values: {cens}\n" +
-       "Instruction decay values: {idecay}\n" +
-       "Connection Kd values: {coKds}\n" +
-       "Connection n values: {cons}").format(cedecay=CELL_DECAY_VALUES[(solution[:temp2[0]].astype(np.int32))].tolist(),
-                                             ceKds=CELL_KD_VALUES[solution[temp2[0]:temp2[1]].astype(np.int32)].tolist(),
-                                             cens=CELL_N_VALUES[solution[temp2[1]:temp2[2]].astype(np.int32)].tolist(),
-                                             idecay=INSTR_DECAY_VALUES[solution[temp2[2]:temp2[3]].astype(np.int32)].tolist(),
-                                             coKds=CONN_KD_VALUES[solution[temp2[3]:temp2[4]].astype(np.int32)].tolist(),
-                                             cons=CONN_N_VALUES[solution[temp2[4]:].astype(np.int32)].tolist()))
-print("Fitness value of the best solution = {solution_fitness}".format(solution_fitness=solution_fitness))
\ No newline at end of file
+def print_solution(solution, solution_fitness):
+    temp1 = np.array([CELL_DECAY_GENES, CELL_KD_GENES, CELL_N_GENES, INSTR_DECAY_GENES, CONN_KD_GENES, CONN_N_GENES])
+    temp2 = [np.sum(temp1[:i+1]) for i in range(len(temp1))]
+    print(("Parameters of the best solution :\n" +
+           "Cell decay values: {cedecay}\n" +
+           "Cell Kd values: {ceKds}\n" +
+           "Cell n values: {cens}\n" +
+           "Instruction decay values: {idecay}\n" +
+           "Connection Kd values: {coKds}\n" +
+           "Connection n values: {cons}").format(cedecay=CELL_DECAY_VALUES[(solution[:temp2[0]].astype(np.int32))].tolist(),
+                                                 ceKds=CELL_KD_VALUES[solution[temp2[0]:temp2[1]].astype(np.int32)].tolist(),
+                                                 cens=CELL_N_VALUES[solution[temp2[1]:temp2[2]].astype(np.int32)].tolist(),
+                                                 idecay=INSTR_DECAY_VALUES[solution[temp2[2]:temp2[3]].astype(np.int32)].tolist(),
+                                                 coKds=CONN_KD_VALUES[solution[temp2[3]:temp2[4]].astype(np.int32)].tolist(),
+                                                 cons=CONN_N_VALUES[solution[temp2[4]:].astype(np.int32)].tolist()))
+    print("Fitness value of the best solution = {solution_fitness}".format(solution_fitness=solution_fitness))
+
+
+if __name__ == "__main__":
+
+    ga_instance = create_ga()
+
+    ga_instance.run()
+    cache.save()
+
+    if PROFILE:
+        print(profiler.report())
+        if PROFILE_FILE:
+            profiler.save(PROFILE_FILE)
+
+    solution, solution_fitness, solution_idx = ga_instance.best_solution()
+    print_solution(solution, solution_fitness)
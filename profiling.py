@@ -0,0 +1,61 @@
+import numpy as np
+import simulator
+
+import json
+import time
+
+
+class GAProfiler:
+    # per-generation breakdown of the work done by the fitness function of a GA run
+    # only evaluations in this process are seen, profile with parallel_processing turned off
+    def __init__(self):
+        self.generations = []
+        self.reset()
+
+    def reset(self):
+        self.stats = simulator.SolverStats(segments=False)
+        self.evaluations = 0
+        self.fitness_time = 0.0
+        self.start = time.perf_counter()
+
+    # pygad fitness function wrapper, works for single and batch fitness functions
+    def wrap(self, fitness_func):
+        def profiled_fitness_func(ga_instance, solution, solution_idx):
+            start = time.perf_counter()
+            with simulator.collect_stats(self.stats):
+                fitness = fitness_func(ga_instance, solution, solution_idx)
+            self.fitness_time += time.perf_counter() - start
+            self.evaluations += 1 if np.ndim(solution) == 1 else len(solution)
+            return fitness
+
+        return profiled_fitness_func
+
+    # pygad on_generation callback, closes the record of a generation
+    def on_generation(self, ga_instance):
+        record = {'generation': ga_instance.generations_completed,
+                  'wall': time.perf_counter() - self.start,
+                  'evaluations': self.evaluations,
+                  'fitness_time': self.fitness_time}
+        record.update(self.stats.summary())
+        # time in the fitness function outside of the solvers and model loading
+        record['other_time'] = self.fitness_time - self.stats.solve_time - self.stats.load_time
+
+        self.generations.append(record)
+        self.reset()
+
+    def totals(self):
+        keys = [key for key in self.generations[0] if key != 'generation'] if self.generations else []
+        return {key: sum(record[key] for record in self.generations) for key in keys}
+
+    def report(self):
+        lines = []
+        for record in self.generations:
+            lines.append(f"gen {record['generation']:4d}: {record['wall']:8.2f} s, {record['evaluations']:5d} evaluations, "
+                         f"fitness {record['fitness_time']:.2f} s (solve {record['solve_time']:.2f} s, load {record['load_time']:.2f} s, "
+                         f"other {record['other_time']:.2f} s), nfev {record['nfev']}, njev {record['njev']}, nlu {record['nlu']}, "
+                         f"steps {record['steps']}")
+        return '\n'.join(lines)
+
+    def save(self, fname):
+        with open(fname, 'w') as f:
+            json.dump({'generations': self.generations, 'totals': self.totals()}, f, indent=2)
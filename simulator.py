@@ -1,9 +1,17 @@
 import numpy as np
 import importlib
 import matplotlib.pyplot as plt
+import scipy.integrate
 from scipy.integrate import solve_ivp
+from scipy.optimize import root
+from scipy.sparse.linalg import eigs, ArpackNoConvergence
 import pandas as pd
 import os 
+import types
+import time
+import contextlib
+import kernels
+import helpers
 
 
 
@@ -17,15 +25,150 @@ def generate_bin_vectors(INS_num):
         
     return np.array(vects)
 
-def get_steady(grn, model=False, rep_num=1, INS_def=False, INS_factor=1, eps=10**(-3)):
+class SolverStats:
+    # work done by the solvers of a simulation, returned by the entry points when called with stats=True
+    def __init__(self, segments=True):
+        self.nfev = 0           # right-hand side evaluations
+        self.njev = 0           # Jacobian evaluations
+        self.nlu = 0            # LU decompositions
+        self.steps = 0          # accepted solver steps
+        self.solves = 0         # solve_ivp calls
+        self.root_solves = 0    # steady state root solves
+        self.solve_time = 0.0   # wall time in the solvers
+        self.load_time = 0.0    # wall time generating, compiling or importing models
+        self.segments = [] if segments else None
+
+    def add_solve(self, sol, steps, wall, t_span):
+        nfev, njev, nlu = int(sol.nfev), int(sol.njev), int(sol.nlu)
+        self.nfev += nfev
+        self.njev += njev
+        self.nlu += nlu
+        self.steps += steps
+        self.solves += 1
+        self.solve_time += wall
+
+        # every solve_ivp call (e.g. a step of simulate_sequence) is a segment
+        if self.segments is not None:
+            self.segments.append({'t_span': tuple(t_span), 'wall': wall, 'nfev': nfev, 'njev': njev,
+                                  'nlu': nlu, 'steps': steps, 'status': int(sol.status)})
+
+    def add_root(self, sol, wall):
+        self.nfev += int(sol.nfev)
+        self.njev += int(sol.get('njev', 0))
+        self.root_solves += 1
+        self.solve_time += wall
+
+    def summary(self):
+        return {'nfev': self.nfev, 'njev': self.njev, 'nlu': self.nlu, 'steps': self.steps, 'solves': self.solves,
+                'root_solves': self.root_solves, 'solve_time': self.solve_time, 'load_time': self.load_time}
+
+    def __repr__(self):
+        return 'SolverStats(' + ', '.join(f'{key}={value:.4g}' if type(value) == float else f'{key}={value}'
+                                          for key, value in self.summary().items()) + ')'
+
+
+# SolverStats that every simulation adds its work to, see collect_stats
+_collectors = []
+
+@contextlib.contextmanager
+def collect_stats(stats):
+    # all simulations inside the block also add their work to stats (None collects nothing)
+    if stats is not None:
+        _collectors.append(stats)
+    try:
+        yield stats
+    finally:
+        if stats is not None:
+            _collectors.remove(stats)
+
+def new_stats(stats):
+    # stats argument of the entry points: False for none, True for a new SolverStats or a SolverStats to add to
+    if stats is True:
+        return SolverStats()
+    return stats or None
+
+def stats_targets(stats):
+    targets = [] if stats is None else [stats]
+    return targets + [c for c in _collectors if c is not stats]
+
+def counting_solver(method, steps):
+    # solver class of method that counts its accepted steps in steps[0]
+    base = getattr(scipy.integrate, method) if type(method) == str else method
+
+    class CountingSolver(base):
+        def _step_impl(self):
+            success, message = super()._step_impl()
+            steps[0] += success
+            return success, message
+
+    return CountingSolver
+
+def run_solver(model, t_span, S0, method='LSODA', stats=None, **kwargs):
+    # solve_ivp on the model with its solver options, the work is added to stats and the active collectors
+    options = solver_options(model, method, len(S0))
+    targets = stats_targets(stats)
+    if not targets:
+        return solve_ivp(model.solve_model, t_span, S0, **options, **kwargs)
+
+    steps = [0]
+    options['method'] = counting_solver(options['method'], steps)
+
+    start = time.perf_counter()
+    sol = solve_ivp(model.solve_model, t_span, S0, **options, **kwargs)
+    wall = time.perf_counter() - start
+
+    for target in targets:
+        target.add_solve(sol, steps[0], wall, t_span)
+
+    return sol
+
+def load_model(grn, model=False, stats=None):
+    # compile the model in memory (cached by the structure of the network)
+    # networks built from template instances use the array-backed kernel instead of generated code
+    start = time.perf_counter()
+
     if type(model) == bool:
-        grn.generate_model()
-        model = 'model'
+        model = grn.compile_vectorized_model() if grn.instances else grn.compile_model()
     if type(model) == str:
-        # read the model module    
-        model_module = importlib.import_module(model.replace(os.sep,'.')) 
-        model_module = importlib.reload(model_module) 
-        model = model_module.solve_model
+        # read the model module
+        model = importlib.import_module(model.replace(os.sep,'.'))
+        model = importlib.reload(model)
+    if not hasattr(model, 'solve_model'):
+        # a bare right-hand side callable, the implicit methods still get the structure of its Jacobian
+        model = types.SimpleNamespace(solve_model=model, jac_sparsity=grn.jacobian_sparsity())
+
+    for target in stats_targets(stats):
+        target.load_time += time.perf_counter() - start
+
+    return model
+
+# from this many states on, BDF and Radau factorize a sparse Jacobian instead of a dense one
+SPARSE_JACOBIAN_SIZE = 100
+
+def solver_options(model, method='LSODA', n_states=0):
+    # implicit methods get the analytic Jacobian of the model, if it provides one
+    # BDF and Radau take it as a sparse matrix for large systems, LSODA only takes dense Jacobians
+    jac = getattr(model, 'jac_model', None)
+    jac_sparse = getattr(model, 'jac_model_sparse', None)
+    jac_sparsity = getattr(model, 'jac_sparsity', None)
+
+    if method in ('BDF', 'Radau'):
+        if n_states >= SPARSE_JACOBIAN_SIZE and jac_sparse is not None:
+            return {'method': method, 'jac': jac_sparse}
+        if jac is not None:
+            return {'method': method, 'jac': jac}
+        if jac_sparsity is not None:
+            # finite differences over groups of independent columns
+            return {'method': method, 'jac_sparsity': jac_sparsity}
+
+    if method == 'LSODA' and jac is not None:
+        return {'method': method, 'jac': jac}
+
+    return {'method': method}
+
+def get_steady(grn, model=False, rep_num=1, INS_def=False, INS_factor=1, eps=10**(-3), method='LSODA', steady='restart', stats=False):
+    stats = new_stats(stats)
+    model = load_model(grn, model, stats)
 
     n_INS = len(grn.input_species_names)
     n_RS = len(grn.species_names) - n_INS
@@ -39,31 +182,137 @@ def get_steady(grn, model=False, rep_num=1, INS_def=False, INS_factor=1, eps=10*
 
     STATES = []
 
-    for _ in range(rep_num):
-        R0 = np.random.random(n_RS)
+    with collect_stats(stats):
+        for _ in range(rep_num):
+            R0 = np.random.random(n_RS)
 
-        for X0 in INS:
-            
-            states = get_steady_single(grn, model, X0, plot_on=False, eps=eps, R0=R0)
-            STATES.append(states[-1])
+            for X0 in INS:
+
+                states = get_steady_single(grn, X0, model, plot_on=False, eps=eps, R0=R0, method=method, steady=steady)
+                STATES.append(states[-1])
 
 
     df = pd.DataFrame(STATES)
     df.columns = grn.species_names
 
-    return df
+    return (df, stats) if stats else df
 
 
-def get_steady_single(grn, IN, model=False, INS_factor=1, plot_on=True, legend=True, eps=10**(-3), R0=False, xlabel='time [a.u.]', ylabel='concentrations [a.u.]'):
-    # read the model module    
-    
-    if type(model) == bool:
-        grn.generate_model()
-        model = 'model'
-    if type(model)==str:
-        model_module = importlib.import_module(model.replace(os.sep,'.')) 
-        model_module = importlib.reload(model_module) 
-        model = model_module.solve_model
+def gray_order(INS_num):
+    # rows of generate_bin_vectors ordered so that neighbours differ in a single input
+    return np.array([i ^ (i >> 1) for i in range(2**INS_num)], dtype=np.int64)
+
+def get_steady_table(grn, model=False, rep_num=1, INS_def=False, INS_factor=1, eps=10**(-3), method='LSODA', warm_start=True, stats=False):
+    # truth table of steady states, same output as get_steady
+    # warm_start=True walks the input combinations in Gray code order, each one solved (root, then event)
+    #                 from the steady state of its neighbour
+    # warm_start=False integrates all combinations and repetitions together as one stacked system
+    n_INS = len(grn.input_species_names)
+    n_S = len(grn.species_names)
+    n_RS = n_S - n_INS
+
+    if INS_def:
+        INS = np.array(INS_def, dtype=float)
+        order = np.arange(len(INS))
+    else:
+        INS = generate_bin_vectors(n_INS) * INS_factor
+        order = gray_order(n_INS)
+
+    n_IN = len(INS)
+    STATES = np.zeros((rep_num*n_IN, n_S))
+    stats = new_stats(stats)
+
+    if warm_start:
+        model = load_model(grn, model, stats)
+
+        for rep in range(rep_num):
+            R0 = np.random.random(n_RS)
+
+            for i in order:
+                S0 = np.append(INS[i], R0)
+
+                states = steady_root(model, S0, n_INS, eps, stats)
+                if states is None:
+                    states = steady_event(model, S0, eps, method, stats=stats)
+
+                STATES[rep*n_IN + i] = states[-1]
+                R0 = states[-1][n_INS:]
+
+    else:
+        start = time.perf_counter()
+        tables = grn.generate_arrays()
+        n_batch = rep_num*n_IN
+        model = kernels.compile_ensemble(tables, np.tile(kernels.get_params(tables), (n_batch, 1)))
+        for target in stats_targets(stats):
+            target.load_time += time.perf_counter() - start
+
+        # species x (repetition, input combination)
+        S0 = np.zeros((n_S, n_batch))
+        S0[:n_INS] = np.tile(INS.T, rep_num)
+        S0[n_INS:] = np.repeat(np.random.random((n_RS, rep_num)), n_IN, axis=1)
+
+        # LSODA would factorize the stacked Jacobian as a dense matrix
+        states = steady_event(model, S0.ravel(), eps, 'BDF' if method == 'LSODA' else method, stats=stats)
+        STATES[:] = states[-1].reshape(n_S, n_batch).T
+
+    df = pd.DataFrame(STATES)
+    df.columns = grn.species_names
+
+    return (df, stats) if stats else df
+
+
+def steady_event(model, S0, eps=10**(-3), method='LSODA', t_max=10**5, stats=None):
+    # integrates until the largest change over 0.1 time units drops below eps (a terminating event)
+    rate = eps/0.1
+
+    def converged(T, state):
+        return np.max(np.abs(model.solve_model(T, state))) - rate
+    converged.terminal = True
+    converged.direction = -1
+
+    if converged(0, S0) < 0:
+        return [S0]
+
+    sol = run_solver(model, [0, t_max], S0, method, stats, events=converged)
+    return list(sol.y.T)
+
+
+def steady_root(model, S0, n_INS, eps=10**(-3), stats=None):
+    # Newton-type root solve on solve_model_steady for the non-input species, None if it fails
+    # or if the root is not a stable (attracting) steady state
+    jac = getattr(model, 'jac_model', None)
+    if jac is None:
+        return None
+
+    steady_model = getattr(model, 'solve_model_steady', lambda state: model.solve_model(0, state))
+    X0 = S0[:n_INS]
+
+    start = time.perf_counter()
+    sol = root(lambda R: steady_model(np.append(X0, R))[n_INS:], S0[n_INS:],
+               jac=lambda R: jac(0, np.append(X0, R))[n_INS:, n_INS:], method='hybr')
+    for target in stats_targets(stats):
+        target.add_root(sol, time.perf_counter() - start)
+
+    # hybr can report failure when it cannot improve an already converged root, so only the residual is checked
+    if np.min(sol.x) < -eps:
+        return None
+
+    S = np.append(X0, sol.x)
+    if np.max(np.abs(steady_model(S))) > eps/0.1:
+        return None
+
+    if np.max(np.linalg.eigvals(jac(0, S)[n_INS:, n_INS:]).real) >= 0:
+        return None
+
+    return [S0, S]
+
+
+def get_steady_single(grn, IN, model=False, INS_factor=1, plot_on=True, legend=True, eps=10**(-3), R0=False, xlabel='time [a.u.]', ylabel='concentrations [a.u.]', method='LSODA', steady='restart', stats=False):
+    # steady: 'restart' integrates in steps of 1 time unit until the state stops changing,
+    #         'event' integrates once with a terminating event,
+    #         'root' solves for the steady state directly and falls back to 'event'
+    stats = new_stats(stats)
+    model = load_model(grn, model, stats)
 
     n_INS = len(grn.input_species_names)
     n_RS = len(grn.species_names) - n_INS
@@ -80,10 +329,17 @@ def get_steady_single(grn, IN, model=False, INS_factor=1, plot_on=True, legend=T
     dt = 0.1
     T = np.arange(0, t_step+dt, dt)
 
+    if steady == 'root':
+        states = steady_root(model, S0, n_INS, eps, stats)
+        if states is None:
+            steady = 'event'
 
-    while True:
+    if steady == 'event':
+        states = steady_event(model, S0, eps, method, stats=stats)
 
-        sol = solve_ivp(model, [0, t_step], states[-1], dense_output=True, method='LSODA') # gre za stiff problem, uporaba LSODA
+    while steady == 'restart':
+
+        sol = run_solver(model, [0, t_step], states[-1], method, stats, dense_output=True) # gre za stiff problem, uporaba LSODA
         z = sol.sol(T)
         Y = z.T
         
@@ -104,21 +360,136 @@ def get_steady_single(grn, IN, model=False, INS_factor=1, plot_on=True, legend=T
 
         plt.show()
 
-    return states
+    return (states, stats) if stats else states
 
 
-def simulate_single(grn, IN, model=False, INS_factor=1, t_end=100, plot_on=True, legend=True, R0=False, xlabel='time [a.u.]', ylabel='concentrations [a.u.]'):
-    if type(model) == bool:
-        grn.generate_model()
-        model = 'model'
-    if type(model)==str:        
-        # read the model module    
-        model_module = importlib.import_module(model.replace(os.sep,'.')) 
-        model_module = importlib.reload(model_module) 
-        model = model_module.solve_model
+def sample_times(t_end, sampling='all'):
+    # 'all' - every time unit, 'end' - only the end, k - every k-th time unit, array - explicit times
+    if type(sampling) == str:
+        if sampling == 'all':
+            return np.arange(0, t_end+1)
+        if sampling == 'end':
+            return np.array([t_end])
+    if np.ndim(sampling) == 0:
+        return np.arange(0, t_end+1, sampling)
+
+    return np.asarray(sampling)
+
+
+def observed_indices(grn, observe=None):
+    # indices of the observed species, given by names or indices (None observes all)
+    if observe is None:
+        return np.arange(len(grn.species_names))
+
+    return np.array([grn.species_names.index(o) if type(o) == str else o for o in observe], dtype=np.int64)
+
+
+def is_stable(model, T, state):
+    # no eigenvalue of the Jacobian has a positive real part (True if the model has no Jacobian)
+    # large systems only look for the rightmost eigenvalue of the sparse Jacobian
+    jac_sparse = getattr(model, 'jac_model_sparse', None)
+    jac = getattr(model, 'jac_model', None)
+
+    if len(state) >= SPARSE_JACOBIAN_SIZE and jac_sparse is not None:
+        try:
+            eigenvalues = eigs(jac_sparse(T, state), k=1, which='LR', return_eigenvectors=False, tol=1e-6)
+        except ArpackNoConvergence:
+            return False
+    elif jac is not None:
+        eigenvalues = np.linalg.eigvals(jac(T, state))
+    else:
+        return True
+
+    return np.max(eigenvalues.real) <= 1e-8
+
+
+def decay_rates(grn, model=None):
+    # decay rate of every species, a parametric model bound to a parameter vector (grn.bind_params) has them
+    # at the end of its vector (layout of grn.get_params), the network only gives its topology then
+    n_S = len(grn.species_names)
+    if hasattr(model, 'params'):
+        return np.array(model.params[-n_S:], dtype=float)
+
+    return np.array([species['delta'] for species in grn.species], dtype=float)
+
+
+def is_settled(rates, delta, settle):
+    # every species is within settle of its steady state, the distance of a decaying species is estimated as
+    # |rate|/delta, species without decay (inputs and integrators) must not change at all
+    decaying = delta > 0
+    if np.any(rates[~decaying] != 0):
+        return False
+
+    return np.all(np.abs(rates[decaying]) < settle*delta[decaying])
+
+
+def integrate_segment(model, S0, t_end, T, method='LSODA', stats=None, settle=None, delta=None):
+    # states at times T and the final state, the solver's interpolant is only used at T (no dense output)
+    # with settle, integration stops once every species is within settle of its steady state (see is_settled)
+    # at a stable state, and the remaining times get the settled state
+    # delta - decay rates of the species (decay_rates), needed with settle
+    t_eval = T if len(T) and T[-1] == t_end else np.append(T, t_end)
+
+    if settle is None:
+        sol = run_solver(model, [0, t_end], S0, method, stats, t_eval=t_eval) # gre za stiff problem, uporaba LSODA
+        return sol.y[:, :len(T)].T, sol.y[:, -1]
+
+    # nothing changes in this segment
+    if is_settled(model.solve_model(0, S0), delta, settle) and is_stable(model, 0, S0):
+        return np.tile(S0, (len(T), 1)), S0
+
+    # the solver is stepped as in solve_ivp (same steps, same states at T), the change over the last accepted step
+    # tells when the state may have settled, only then the right-hand side and the stability are checked
+    # slow passages through unstable states (e.g. a latch that has not decided yet) are integrated on, such a
+    # state is checked again only after it moved away
+    options = solver_options(model, method, len(S0))
+    solver_class = options.pop('method')
+    solver_class = getattr(scipy.integrate, solver_class) if type(solver_class) == str else solver_class
+    solver = solver_class(model.solve_model, 0, S0, t_end, **options)
+
+    Y = np.empty((len(T), len(S0)))
+    i = 0
+    steps = 0
+    armed = True
+    start = time.perf_counter()
+
+    while solver.status == 'running':
+        y_old = solver.y
+        message = solver.step()
+        if solver.status == 'failed':
+            raise RuntimeError(f'Integration failed at t={solver.t}: {message}')
+        steps += 1
+
+        # the time in T equal to the solver's time is included
+        i_new = min(np.searchsorted(T, solver.t, side='right'), len(T))
+        if i_new > i:
+            Y[i:i_new] = solver.dense_output()(T[i:i_new]).T
+            i = i_new
+
+        if not is_settled((solver.y - y_old)/(solver.t - solver.t_old), delta, settle):
+            armed = True
+        elif armed:
+            armed = False
+            if is_settled(model.solve_model(solver.t, solver.y), delta, settle) and is_stable(model, solver.t, solver.y):
+                break
+
+    S = solver.y
+    Y[i:] = S
+
+    for target in stats_targets(stats):
+        sol = types.SimpleNamespace(nfev=solver.nfev, njev=solver.njev, nlu=solver.nlu, status=0)
+        target.add_solve(sol, steps, time.perf_counter() - start, (0, t_end))
+
+    return Y, S
+
+
+def simulate_single(grn, IN, model=False, INS_factor=1, t_end=100, plot_on=True, legend=True, R0=False, xlabel='time [a.u.]', ylabel='concentrations [a.u.]', method='LSODA', sampling='all', observe=None, dtype=np.float64, stats=False):
+    stats = new_stats(stats)
+    model = load_model(grn, model, stats)
 
     n_INS = len(grn.input_species_names)
     n_RS = len(grn.species_names) - n_INS
+    observed = observed_indices(grn, observe)
 
     X0 = np.array(IN)*INS_factor
     if type(R0)==bool:
@@ -126,67 +497,175 @@ def simulate_single(grn, IN, model=False, INS_factor=1, t_end=100, plot_on=True,
         
     S0 = np.append(X0,R0)
 
-    sol = solve_ivp(model, [0, t_end], S0, dense_output=True, method='LSODA') # gre za stiff problem, uporaba LSODA
-    T = np.arange(0, t_end+1)
-    z = sol.sol(T)
-    Y = z.T
+    T = sample_times(t_end, sampling)
+    Y, _ = integrate_segment(model, S0, t_end, T, method, stats)
+    Y = Y[:, observed].astype(dtype)
 
     if plot_on:
         plt.plot(T,Y)
         if legend:
-            plt.legend(grn.species_names)
+            plt.legend(np.array(grn.species_names)[observed])
         
         plt.xlabel(xlabel)
         plt.ylabel(ylabel)
         
         plt.show()
 
-    return T,Y
+    return (T, Y, stats) if stats else (T, Y)
 
 
-def simulate_sequence(grn, IN_seq, model=False, INS_factor=1, t_single=100, plot_on=True, legend=True, xlabel='time [a.u.]', ylabel='concentrations [a.u.]'):
-    if type(model) == bool:
-        grn.generate_model()
-        model = 'model'
-    if type(model)==str:        
-        # read the model module    
-        model_module = importlib.import_module(model.replace(os.sep,'.')) 
-        model_module = importlib.reload(model_module) 
-        model = model_module.solve_model
+def simulate_sequence_stream(grn, IN_seq, model=False, INS_factor=1, t_single=100, method='LSODA', sampling='all', observe=None, dtype=np.float64, stats=None, settle=None):
+    # yields (T, Y) of each input step as soon as it is simulated, IN_seq can be any iterable
+    # the work is added to stats (a SolverStats) as the steps are simulated
+    # settle - each step stops once every species is within settle of its (stable) steady state and the rest of
+    #          it is filled with the settled state, species without decay must stop changing (see is_settled)
+    model = load_model(grn, model, stats)
+    delta = decay_rates(grn, model) if settle is not None else None
 
     n_INS = len(grn.input_species_names)
     n_RS = len(grn.species_names) - n_INS
-    R0 = False
-
-    T = False
-    Y = False
+    observed = observed_indices(grn, observe)
+    T1 = sample_times(t_single, sampling)
 
-    for IN in IN_seq:
+    # start with all non-input species at zero
+    R0 = np.zeros(n_RS)
 
+    for i, IN in enumerate(IN_seq):
         X0 = np.array(IN)*INS_factor
-        if type(R0)==bool:
-            #R0 = np.random.random(n_RS)
-            R0 = np.zeros(n_RS)
-        else:
-            R0 = Y1[-1, -n_RS:]
 
-        T1, Y1 = simulate_single(grn, X0, model, INS_factor=1, t_end=t_single, plot_on=False, R0=R0)
+        Y1, S1 = integrate_segment(model, np.append(X0, R0), t_single, T1, method, stats, settle, delta)
+        R0 = S1[n_INS:]
+
+        yield T1 + i*t_single, Y1[:, observed].astype(dtype)
+
+
+def simulate_sequence(grn, IN_seq, model=False, INS_factor=1, t_single=100, plot_on=True, legend=True, xlabel='time [a.u.]', ylabel='concentrations [a.u.]', method='LSODA', sampling='all', observe=None, dtype=np.float64, stats=False, settle=None):
+    stats = new_stats(stats)
+    observed = observed_indices(grn, observe)
+    n_T = len(sample_times(t_single, sampling))
 
-        if type(T) == bool:
-            T = T1
-            Y = Y1
-        else:
-            Y = np.concatenate([Y, Y1])
-            T = np.append(T, T1+T[-1])
+    # output is preallocated for all steps
+    T = np.zeros(len(IN_seq)*n_T)
+    Y = np.zeros((len(IN_seq)*n_T, len(observed)), dtype=dtype)
+
+    for i, (T1, Y1) in enumerate(simulate_sequence_stream(grn, IN_seq, model, INS_factor, t_single, method, sampling, observe, dtype, stats, settle)):
+        T[i*n_T:(i+1)*n_T] = T1
+        Y[i*n_T:(i+1)*n_T] = Y1
 
     if plot_on:
         plt.plot(T,Y)
         if legend:
-            plt.legend(grn.species_names)
+            plt.legend(np.array(grn.species_names)[observed])
 
         plt.xlabel(xlabel)
         plt.ylabel(ylabel)
         
         plt.show()
 
-    return T,Y
\ No newline at end of file
+    return (T, Y, stats) if stats else (T, Y)
+
+
+def input_trajectory(IN_seq, t_single=100, INS_factor=1, sampling='all'):
+    # values of the input species at the sampled times of simulate_sequence, (time, inputs)
+    n_T = len(sample_times(t_single, sampling))
+    X = np.array([np.atleast_1d(np.array(IN)*INS_factor) for IN in IN_seq], dtype=float)
+
+    return np.repeat(X, n_T, axis=0)
+
+
+def score_sequence(grn, IN_seq, truth, columns, bound=np.inf, model=False, INS_factor=1, t_single=100, method='LSODA', sampling='all', stats=False, settle=None):
+    # sum over the columns of the MSE of simulate_sequence against truth ((columns,) time), scored segment by segment
+    # the simulation stops as soon as the error so far exceeds bound, the score is then a lower bound of the full one
+    # returns (score, complete) (and stats)
+    stats = new_stats(stats)
+    truth = np.atleast_2d(truth)
+    n_total = truth.shape[1]
+
+    Y = np.zeros((n_total, truth.shape[0]))
+    sse = 0.0
+    start = 0
+    complete = True
+
+    for T1, Y1 in simulate_sequence_stream(grn, IN_seq, model, INS_factor, t_single, method, sampling, columns, stats=stats, settle=settle):
+        Y[start:start+len(T1)] = Y1
+        sse += np.sum((Y1 - truth[:, start:start+len(T1)].T)**2)
+        start += len(T1)
+
+        # squared errors only add up, so the remaining segments cannot bring the score under the bound
+        if sse/n_total > bound:
+            complete = False
+            break
+
+    if complete:
+        # same summation as scoring the full trajectory
+        score = sum(helpers.trajectory_mse(Y, truth, np.arange(truth.shape[0])))
+    else:
+        score = sse/n_total
+
+    return (score, complete, stats) if stats else (score, complete)
+
+
+def simulate_ensemble(grn, params, IN_seq, INS_factor=1, t_single=100, method='BDF', R0=False, stats=False, stacked=False):
+    # simulates a batch of parameter sets (batch, params) on the topology of grn, params follow the layout of
+    # grn.get_params(), the result has shape (batch, time, species)
+    # stacked=False integrates the members one after another with the parametric model of the topology, so a
+    #               member's trajectory does not depend on the rest of the batch
+    # stacked=True integrates the batch as one stacked system of the array-backed kernel, faster for large batches
+    #              but the members share the solver's steps (a latch started on a saddle falls into a state
+    #              decided by those steps)
+    from grn import bind_params
+
+    stats = new_stats(stats)
+    params = np.atleast_2d(params)
+
+    n_batch = params.shape[0]
+    n_INS = len(grn.input_species_names)
+    n_S = len(grn.species_names)
+
+    t_eval = np.arange(0, t_single+1)
+    T = np.concatenate([t_eval + i*t_single for i in range(len(IN_seq))])
+    Y = np.zeros((n_batch, len(T), n_S))
+
+    R = np.zeros((n_S - n_INS, n_batch))
+    if type(R0) != bool:
+        R[:] = np.reshape(R0, (n_S - n_INS, -1))
+
+    if not stacked:
+        start = time.perf_counter()
+        model = grn.compile_parametric_model()
+        for target in stats_targets(stats):
+            target.load_time += time.perf_counter() - start
+
+        for j in range(n_batch):
+            member = bind_params(model, params[j])
+            state = np.append(np.zeros(n_INS), R[:, j])
+
+            for i, IN in enumerate(IN_seq):
+                state[:n_INS] = np.array(IN)*INS_factor
+                Y[j, i*len(t_eval):(i+1)*len(t_eval)], state = integrate_segment(member, state, t_single, t_eval, method, stats)
+
+        return (T, Y, stats) if stats else (T, Y)
+
+    start = time.perf_counter()
+    model = kernels.compile_ensemble(grn.generate_arrays(), params)
+    for target in stats_targets(stats):
+        target.load_time += time.perf_counter() - start
+
+    # solve_ivp controls the RMS error over all n_S*n_batch components, which would dilute the error of a single
+    # member by sqrt(n_batch), the tightened tolerances keep every member's error within the default ones
+    rtol = 1e-3/np.sqrt(n_batch)
+    atol = 1e-6/np.sqrt(n_batch)
+
+    state = np.zeros((n_S, n_batch))
+    state[n_INS:] = R
+
+    for i, IN in enumerate(IN_seq):
+        state[:n_INS] = np.reshape(np.array(IN)*INS_factor, (n_INS, 1))
+
+        sol = run_solver(model, [0, t_single], state.ravel(), method, stats, t_eval=t_eval, rtol=rtol, atol=atol)
+        Z = sol.y.reshape(n_S, n_batch, -1)
+
+        Y[:, i*len(t_eval):(i+1)*len(t_eval)] = np.transpose(Z, (1, 2, 0))
+        state = Z[:, :, -1]
+
+    return (T, Y, stats) if stats else (T, Y)
@@ -0,0 +1,152 @@
+import numpy as np
+import kernels, simulator
+
+
+# Stochastic simulation of a grn as a birth-death process: every species is produced at the summed expression
+# rate of its genes (the Hill terms of kernels) and every molecule decays at rate delta. A batch of
+# trajectories is simulated at once with adaptive tau-leaping (Cao, Gillespie, Petzold 2006), trajectories
+# where a leap would cover only a few reactions take exact SSA steps instead.
+
+
+# Species with fewer molecules than this have critical decays (they fire one at a time, never leaped)
+N_CRITICAL = 10
+
+# A trajectory takes exact SSA steps when a leap would be shorter than this many mean SSA steps
+SSA_FACTOR = 10
+
+
+def propensities(x, tables, volume=1):
+    # production and decay propensities (species, batch) of counts x (species, batch)
+    # rates are in concentrations, volume converts them to molecule numbers
+    production = volume*(tables['P'] @ kernels.gene_rates(x/volume, tables))
+    decay = tables['delta'][:, None]*x
+    production[:tables['n_inputs']] = 0
+    decay[:tables['n_inputs']] = 0
+
+    return production, decay
+
+
+def leap_size(x, production, decay, epsilon=0.03):
+    # largest leap per trajectory that changes no propensity by more than about epsilon (Cao et al. 2006),
+    # from the non-critical reactions, all reactions change their species by one
+    bound = np.maximum(epsilon*x, 1)
+    critical = x < N_CRITICAL
+    mean = production - np.where(critical, 0, decay)
+    variance = production + np.where(critical, 0, decay)
+
+    with np.errstate(divide='ignore'):
+        tau = np.minimum(np.where(mean != 0, bound/np.abs(mean), np.inf),
+                         np.where(variance > 0, bound**2/variance, np.inf))
+
+    return tau.min(axis=0)
+
+
+def integrate_segment(x, t_end, T, tables, rng, volume=1, epsilon=0.03):
+    # advances the counts x (species, batch) from 0 to t_end, returns the counts at times T (batch, time, species)
+    # and at t_end
+    n_species, n_batch = x.shape
+    stops = T if len(T) and T[-1] == t_end else np.append(T, t_end)
+
+    Y = np.zeros((n_batch, len(T), n_species))
+    t = np.zeros(n_batch)
+    k = np.zeros(n_batch, dtype=np.int64)
+    batch = np.arange(n_batch)
+    shrink = np.ones(n_batch)
+
+    while True:
+        # the trajectories record every stop they have reached
+        reached = (k < len(stops)) & (t >= stops[np.minimum(k, len(stops)-1)])
+        while reached.any():
+            b = batch[reached & (k < len(T))]
+            Y[b, k[b]] = x[:, b].T
+            k[reached] += 1
+            reached = (k < len(stops)) & (t >= stops[np.minimum(k, len(stops)-1)])
+
+        active = k < len(stops)
+        if not active.any():
+            return Y, x
+
+        t_next = np.where(active, stops[np.minimum(k, len(stops)-1)], t)
+        production, decay = propensities(x, tables, volume)
+        a0 = production.sum(axis=0) + decay.sum(axis=0)
+
+        critical = (x < N_CRITICAL) & (decay > 0)
+        a_critical = np.where(critical, decay, 0).sum(axis=0)
+
+        with np.errstate(divide='ignore'):
+            tau = leap_size(x, production, decay, epsilon)*shrink
+            ssa = active & (tau < SSA_FACTOR/a0)
+            leap = active & ~ssa
+
+        # exact SSA step, a step past the next stop only moves the time (the process is memoryless)
+        if ssa.any():
+            b = batch[ssa]
+            with np.errstate(divide='ignore'):
+                dt = rng.exponential(1, len(b))/a0[b]
+            fire = t[b] + dt <= t_next[b]
+
+            a = np.concatenate([production[:, b], decay[:, b]])
+            u = rng.random(len(b))*a0[b]
+            r = np.argmax(np.cumsum(a, axis=0) > u, axis=0)
+            fired = b[fire]
+            np.add.at(x, (r[fire] % n_species, fired), np.where(r[fire] < n_species, 1, -1))
+
+            t[b] = np.where(fire, t[b] + dt, t_next[b])
+
+        # leap of the non-critical reactions, at most one critical decay fires (at its exact time)
+        if leap.any():
+            b = batch[leap]
+            dt_critical = rng.exponential(1, len(b))/np.where(a_critical[b] > 0, a_critical[b], np.nan)
+            dt_critical = np.where(a_critical[b] > 0, dt_critical, np.inf)
+            dt = np.minimum(np.minimum(tau[b], dt_critical), t_next[b] - t[b])
+
+            births = rng.poisson(production[:, b]*dt)
+            deaths = rng.poisson(np.where(critical[:, b], 0, decay[:, b])*dt)
+            x_new = x[:, b] + births - deaths
+
+            # one critical decay, chosen by its propensity
+            fire = dt_critical <= dt
+            if fire.any():
+                a = np.where(critical[:, b], decay[:, b], 0)
+                u = rng.random(len(b))*np.where(fire, a_critical[b], 0)
+                s = np.argmax(np.cumsum(a, axis=0) > u, axis=0)
+                x_new[s[fire], np.flatnonzero(fire)] -= 1
+
+            # leaps that made a count negative are taken again with half the size
+            valid = (x_new >= 0).all(axis=0)
+            x[:, b[valid]] = x_new[:, valid]
+            # leaps to the next stop land on it exactly
+            t[b[valid]] = np.where(dt >= t_next[b] - t[b], t_next[b], t[b] + dt)[valid]
+            shrink[b[valid]] = 1
+            shrink[b[~valid]] /= 2
+
+
+def simulate_stochastic(grn, IN_seq, n_trajectories=100, INS_factor=1, t_single=100, sampling='all', observe=None, volume=1, epsilon=0.03, seed=None):
+    # stochastic counterpart of simulator.simulate_sequence for a batch of trajectories, returns T and
+    # Y (trajectories, time, species) in concentrations (molecule numbers over volume)
+    # volume - molecules per unit of concentration, the noise shrinks as it grows
+    # epsilon - accuracy of the leaps (largest relative change of a propensity in a leap)
+    # seed - seed (or Generator) of the random numbers
+    rng = np.random.default_rng(seed)
+    tables = kernels.build_tables(grn)
+
+    n_INS = tables['n_inputs']
+    n_species = len(tables['species_names'])
+    observed = simulator.observed_indices(grn, observe)
+    T1 = simulator.sample_times(t_single, sampling)
+
+    T = np.zeros(len(IN_seq)*len(T1))
+    Y = np.zeros((n_trajectories, len(IN_seq)*len(T1), len(observed)))
+
+    # start with no molecules of the non-input species
+    x = np.zeros((n_species, n_trajectories))
+
+    for i, IN in enumerate(IN_seq):
+        x[:n_INS] = np.round(np.atleast_1d(IN)*INS_factor*volume)[:, None]
+
+        Y1, x = integrate_segment(x, t_single, T1, tables, rng, volume, epsilon)
+
+        T[i*len(T1):(i+1)*len(T1)] = T1 + i*t_single
+        Y[:, i*len(T1):(i+1)*len(T1)] = Y1[:, :, observed]/volume
+
+    return T, Y
@@ -0,0 +1,263 @@
+import numpy as np
+import grn, simulator, kernels, params
+import msdflipflop, counter2m
+
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+# ------------------------
+# SETTINGS
+# ------------------------
+
+# Samples written to one chunk file
+CHUNK_SIZE = 256
+
+# Number of worker processes (None uses all cores)
+WORKERS = None
+
+# Simulation of a single sample (see simulator.get_steady and simulator.simulate_sequence)
+INS_FACTOR = 100
+T_SINGLE = 250
+
+# Steady state mode of get_steady, 'root' (falling back to 'event') is bounded by the t_max of
+# simulator.steady_event, 'restart' never returns for samples that oscillate
+STEADY = 'root'
+
+clks = np.concatenate([np.repeat(0, 5), [100 if i%4==0 else 0 for i in range(10)]])
+
+# ------------------------
+# SAMPLING
+# ------------------------
+
+# Default number of samples of the two sampling methods (the grid has 5 values per parameter of params.ranges)
+LHS_SAMPLES = 1000
+GRID_SAMPLES = 625
+
+# Values per parameter of a grid of at most n_samples points over n_params parameters
+def grid_values(n_samples, n_params):
+    k = int(round(n_samples**(1/n_params)))
+    while k > 1 and k**n_params > n_samples:
+        k -= 1
+    while (k+1)**n_params <= n_samples:
+        k += 1
+
+    return k
+
+# Samples over ranges ({name: (low, high)}, params.ranges by default) as {name: (samples,)}
+# 'lhs' - Latin hypercube of n_samples points, 'grid' - full grid of at most n_samples points
+# (grid_values evenly spaced values per parameter)
+def sample_ranges(n_samples, method='lhs', ranges=None, seed=None):
+    ranges = params.ranges if ranges is None else ranges
+    rng = np.random.default_rng(seed)
+    names = list(ranges)
+
+    if method == 'lhs':
+        # one point in every of the n_samples strata of every parameter, strata paired at random
+        u = (np.array([rng.permutation(n_samples) for _ in names]) + rng.random((len(names), n_samples)))/n_samples
+    elif method == 'grid':
+        axes = np.meshgrid(*[np.linspace(0, 1, grid_values(n_samples, len(names))) for _ in names], indexing='ij')
+        u = np.array([axis.ravel() for axis in axes])
+    else:
+        raise ValueError(f'Invalid sampling method {method}!')
+
+    return {name: ranges[name][0] + u[i]*(ranges[name][1] - ranges[name][0]) for i, name in enumerate(names)}
+
+# Parameter vectors (samples, params) of a network (layout of grn.get_params) with every gene, regulator
+# and decaying species set to the sampled alpha, Kd, n and delta (parameters that are not sampled keep
+# their values)
+def network_params(network, samples):
+    tables = kernels.build_tables(network)
+    layout = kernels.param_layout(tables)
+    n_samples = len(next(iter(samples.values())))
+
+    P = np.tile(network.get_params(), (n_samples, 1))
+
+    for name in ('alpha', 'Kd', 'n'):
+        if name in samples:
+            P[:, layout[name]] = np.asarray(samples[name])[:, None]
+
+    # inputs and species built without decay keep none
+    if 'delta' in samples:
+        species = layout['delta'].start + np.flatnonzero(tables['delta'] > 0)
+        P[:, species] = np.asarray(samples['delta'])[:, None]
+
+    return P
+
+# ------------------------
+# WORKERS
+# ------------------------
+
+# The network and its parametric model, compiled once in every worker
+worker = {}
+
+def init_worker(network, mode, options, seed):
+    worker['network'] = network
+    worker['model'] = network.compile_parametric_model()
+    worker['mode'] = mode
+    worker['options'] = options
+    worker['seed'] = seed
+
+# Shape of the result of a single sample
+def result_shape(network, mode, options):
+    if mode == 'steady':
+        n_INS = len(network.input_species_names)
+        states = len(options['INS_def']) if options.get('INS_def') else 2**n_INS
+        return (options.get('rep_num', 1)*states, len(network.species_names))
+
+    T1 = simulator.sample_times(options.get('t_single', 100), options.get('sampling', 'all'))
+    return (len(clks)*len(T1), len(simulator.observed_indices(network, options.get('observe'))))
+
+# Results of the samples with the given indices and parameter vectors (samples, ...) and the error of every
+# sample ('' if it succeeded), samples whose simulation fails or gives non-finite values are NaN
+def run_chunk(indices, P):
+    network = worker['network']
+    results = np.full((len(indices),) + result_shape(network, worker['mode'], worker['options']), np.nan)
+    errors = [''] * len(indices)
+
+    for i, (index, p) in enumerate(zip(indices, P)):
+        model = grn.bind_params(worker['model'], p)
+
+        try:
+            if worker['mode'] == 'steady':
+                # the random initial states of get_steady depend only on the seed and the sample
+                np.random.seed([worker['seed'] or 0, index])
+                results[i] = simulator.get_steady(network, model, **worker['options']).to_numpy()
+            else:
+                _, results[i] = simulator.simulate_sequence(network, clks, model, plot_on=False, **worker['options'])
+        except (ValueError, ArithmeticError) as e:
+            results[i] = np.nan
+            errors[i] = f'{type(e).__name__}: {e}'
+            continue
+
+        if not np.all(np.isfinite(results[i])):
+            errors[i] = 'non-finite result'
+
+    return results, np.array(errors)
+
+# ------------------------
+# RUNNING THE SWEEP
+# ------------------------
+
+def chunk_file(out, c):
+    return os.path.join(out, f'chunk_{c:06d}.npz')
+
+# Runs the network for every sample and writes the results to out in chunks of CHUNK_SIZE samples,
+# chunks already in out (of the same sweep) are not run again, so an interrupted sweep continues where it stopped
+# mode - 'steady' (get_steady) or 'sequence' (simulate_sequence of clks), options - their keyword arguments
+def run(network, out, n_samples, method='lhs', ranges=None, seed=None, mode='steady', options=None,
+        chunk_size=CHUNK_SIZE, workers=WORKERS):
+    ranges = params.ranges if ranges is None else ranges
+    options = {} if options is None else options
+    if mode == 'steady':
+        options = {'steady': STEADY, **options}
+
+    samples = sample_ranges(n_samples, method, ranges, seed)
+    names = list(samples)
+    P = network_params(network, samples)
+
+    # the description of the sweep is kept with the chunks, a different sweep cannot continue them
+    meta = {'n_samples': n_samples, 'method': method, 'ranges': {k: list(v) for k, v in ranges.items()},
+            'seed': seed, 'mode': mode, 'options': {k: repr(v) for k, v in options.items()},
+            'chunk_size': chunk_size, 'species': network.species_names, 'hash': network.topology_hash()}
+
+    os.makedirs(out, exist_ok=True)
+    meta_file = os.path.join(out, 'sweep.json')
+    if os.path.exists(meta_file):
+        with open(meta_file) as f:
+            if json.load(f) != meta:
+                raise ValueError(f'{out} holds a different sweep!')
+    else:
+        with open(meta_file, 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    n_chunks = (len(P) + chunk_size - 1)//chunk_size
+    todo = [c for c in range(n_chunks) if not os.path.exists(chunk_file(out, c))]
+
+    workers = workers or os.cpu_count()
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=init_worker,
+                                                initargs=(network, mode, options, seed)) as executor:
+        # only a few chunks per worker are in flight, results are written as soon as they arrive
+        pending = {}
+        queue = list(todo)
+        max_pending = 2*workers
+
+        while queue or pending:
+            while queue and len(pending) < max_pending:
+                c = queue.pop(0)
+                indices = np.arange(c*chunk_size, min((c+1)*chunk_size, len(P)))
+                pending[executor.submit(run_chunk, indices, P[indices])] = (c, indices)
+
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                c, indices = pending.pop(future)
+
+                results, errors = future.result()
+                failed = errors != ''
+
+                # written under a temporary name first, a chunk file is always complete
+                tmp = chunk_file(out, c) + '.tmp.npz'
+                np.savez(tmp, index=indices, params=P[indices], results=results, error=errors,
+                         **{name: samples[name][indices] for name in names})
+                os.replace(tmp, chunk_file(out, c))
+
+                print(f'chunk {c+1}/{n_chunks} done, {np.sum(failed)} of {len(indices)} samples failed'
+                      + (f' (first: sample {indices[failed][0]}, {errors[failed][0]})' if failed.any() else ''), file=sys.stderr)
+
+    return meta
+
+# All results of a sweep in out as one dict of arrays (index, params, results, error and the sampled parameters)
+# (only the chunks written so far)
+def load(out):
+    chunks = []
+    for name in sorted(os.listdir(out)):
+        if name.startswith('chunk_') and not name.endswith('.tmp.npz'):
+            with np.load(os.path.join(out, name)) as data:
+                chunks.append(dict(data))
+
+    return {key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]} if chunks else {}
+
+# ------------------------
+# NETWORKS
+# ------------------------
+
+def build_network(name, d=2):
+    network = grn.grn()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        if name == 'flipflop':
+            msdflipflop.registercell("cell", network, inputname="cell_QBAR")
+        else:
+            counter2m.counterregister(network, d)
+
+    return network
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Parameter sweep over params.ranges.')
+    parser.add_argument('out', help='directory of the chunk files (an existing sweep there is continued)')
+    parser.add_argument('--network', choices=['flipflop', 'counter'], default='flipflop')
+    parser.add_argument('--d', type=int, default=2, help='counter size')
+    parser.add_argument('--mode', choices=['steady', 'sequence'], default='steady')
+    parser.add_argument('--samples', type=int, default=None,
+                        help=f'number of samples (default {LHS_SAMPLES} for lhs, {GRID_SAMPLES} for grid)')
+    parser.add_argument('--method', choices=['lhs', 'grid'], default='lhs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    args = parser.parse_args()
+
+    n_samples = args.samples or (LHS_SAMPLES if args.method == 'lhs' else GRID_SAMPLES)
+    network = build_network(args.network, args.d)
+    options = {'INS_factor': INS_FACTOR} if args.mode == 'steady' else {'t_single': T_SINGLE}
+
+    start = time.perf_counter()
+    run(network, args.out, n_samples, args.method, seed=args.seed, mode=args.mode, options=options,
+        chunk_size=args.chunk, workers=args.workers)
+    print(f'done in {time.perf_counter() - start:.1f} s', file=sys.stderr)